@@ -0,0 +1,82 @@
+"""Compares the memory used by library Member objects and CompactMember records.
+
+Usage: python benchmarks/member_cache_memory.py [member_count]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+import discord
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from member_cache import CompactMemberCache  # noqa: E402
+
+GUILD_ID = 1
+ROLE_COUNT = 50
+ROLES_PER_MEMBER = 3
+ROLE_ID_BASE = 1_200_000_000_000_000_000
+
+
+def member_payloads(count):
+    for i in range(count):
+        member_id = 10_000_000_000_000_000 + i
+        yield {
+            "user": {"id": str(member_id), "username": f"user{i}", "discriminator": "0", "global_name": f"User {i}", "avatar": None},
+            "nick": f"nick{i}" if i % 4 == 0 else None,
+            "roles": [str(ROLE_ID_BASE + (i + r) % ROLE_COUNT) for r in range(ROLES_PER_MEMBER)],
+            "joined_at": "2024-01-01T00:00:00+00:00",
+            "deaf": False,
+            "mute": False,
+            "flags": 0,
+        }
+
+
+def build_guild():
+    client = discord.Client(intents=discord.Intents.default())
+    state = client._connection
+    data = {
+        "id": str(GUILD_ID),
+        "name": "bench",
+        "roles": [{"id": str(ROLE_ID_BASE + r), "name": f"role{r}", "permissions": "0", "position": r} for r in range(ROLE_COUNT)],
+    }
+    return discord.Guild(data=data, state=state), state
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    guild, state = build_guild()
+
+    def build_members():
+        for data in member_payloads(count):
+            guild._add_member(discord.Member(data=data, guild=guild, state=state))
+        return guild
+
+    def build_compact():
+        cache = CompactMemberCache()
+        for data in member_payloads(count):
+            cache.add_data(GUILD_ID, data)
+        return cache
+
+    _, member_bytes = measure(build_members)
+    _, compact_bytes = measure(build_compact)
+
+    print(f"members:          {count}")
+    print(f"discord.Member:   {member_bytes / count:8.1f} bytes/member  {member_bytes / 1024 / 1024:8.1f} MiB")
+    print(f"CompactMember:    {compact_bytes / count:8.1f} bytes/member  {compact_bytes / 1024 / 1024:8.1f} MiB")
+    print(f"reduction:        {100 * (1 - compact_bytes / member_bytes):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import json
+import os
+from discord.ext import commands
+
+# Command extensions, by the command set name servers choose with !command_set
+EXTENSIONS = {
+    "stable": "extensions.stable",
+    "beta": "extensions.beta",
+}
+DEFAULT_COMMAND_SET = os.getenv('DEFAULT_COMMAND_SET', 'stable')
+COMMAND_SET_FILE = os.getenv('COMMAND_SET_FILE', 'dosi_command_sets.json')
+
+# Commands of each loaded set, by name. Extensions register here instead of on the bot,
+# because the stable and beta sets use the same command names.
+command_sets = {}
+# Command set chosen per server (guild ID -> set name); other servers use DEFAULT_COMMAND_SET
+guild_command_sets = {}
+
+
+def register_command_set(name, namespace):
+    """Registers every command defined in an extension module (pass its globals())."""
+    command_set = {}
+    for command in namespace.values():
+        if isinstance(command, commands.Command):
+            command_set[command.name] = command
+            for alias in command.aliases:
+                command_set[alias] = command
+    command_sets[name] = command_set
+    return command_set
+
+
+def unregister_command_set(name):
+    command_sets.pop(name, None)
+
+
+def all_set_commands():
+    for command_set in command_sets.values():
+        yield from set(command_set.values())
+
+
+def command_set_for(guild):
+    if guild is None:
+        return DEFAULT_COMMAND_SET
+    return guild_command_sets.get(guild.id, DEFAULT_COMMAND_SET)
+
+
+def find_command(guild, name):
+    """Looks up a command in the set the server uses. Returns None if it has no such command."""
+    return command_sets.get(command_set_for(guild), {}).get(name)
+
+
+def load_guild_command_sets():
+    try:
+        with open(COMMAND_SET_FILE, encoding="utf-8") as f:
+            guild_command_sets.update({int(guild_id): name for guild_id, name in json.load(f).items()})
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Error loading {COMMAND_SET_FILE}: {e}")
+
+
+def set_guild_command_set(guild_id, name):
+    """Selects the command set for a server and saves the choice so it survives restarts."""
+    if name == DEFAULT_COMMAND_SET:
+        guild_command_sets.pop(guild_id, None)
+    else:
+        guild_command_sets[guild_id] = name
+    temp_file = f"{COMMAND_SET_FILE}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump({str(guild_id): set_name for guild_id, set_name in guild_command_sets.items()}, f)
+    os.replace(temp_file, COMMAND_SET_FILE)
+
+
+class CommandSetHelpCommand(commands.DefaultHelpCommand):
+    """!help for servers with command sets: lists the commands of the set the server uses next to the
+    bot's own commands, and finds set commands for !help <command>, since they are not added to the bot."""
+
+    async def send_bot_help(self, mapping):
+        set_name = command_set_for(self.context.guild)
+        set_commands = await self.filter_commands(set(command_sets.get(set_name, {}).values()), sort=True)
+        bot_commands = await self.filter_commands(self.context.bot.commands, sort=True)
+        max_size = self.get_max_size(set_commands + bot_commands)
+        self.add_indented_commands(set_commands, heading=f"{set_name.capitalize()} commands:", max_size=max_size)
+        self.add_indented_commands(bot_commands, heading="Bot commands:", max_size=max_size)
+        self.paginator.add_line()
+        self.paginator.add_line(self.get_ending_note())
+        await self.send_pages()
+
+    def get_ending_note(self):
+        # The set and bot headings are not cogs, so the default note about categories does not apply
+        return f"Type {self.context.clean_prefix}{self.invoked_with} command for more info on a command."
+
+    async def command_callback(self, ctx, /, *, command=None):
+        if command is not None and command not in ctx.bot.all_commands:
+            set_command = find_command(ctx.guild, command)
+            if set_command is not None:
+                await self.prepare_help_command(ctx, command)
+                return await self.send_command_help(set_command)
+        return await super().command_callback(ctx, command=command)
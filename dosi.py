@@ -1,6 +1,19 @@
 import discord
 from discord.ext import commands
-import os
+import os
+import asyncio
+import io
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from command_sets import EXTENSIONS, CommandSetHelpCommand, all_set_commands, command_set_for, command_sets, find_command, load_guild_command_sets, set_guild_command_set
+from member_cache import CompactMemberCache, install_compact_member_cache
+from memory_stats import CacheBudgets, SnapshotStore, cache_breakdown, format_size, format_statistics, parse_size, rss_bytes
+from extensions.state import in_flight_operations, pending_plans, role_overwrite_index
+from tracing import install_tracing, mark_arguments_parsed, trace_command
 
 # Configure intents
 intents = discord.Intents.default()
@@ -9,497 +22,383 @@ intents.guild_messages = True
 intents.members = True  # For managing roles
 intents.message_content = True  # For processing message commands (optional)
 
+# Optional compact member cache: keeps only ID, username, nickname and role IDs per member
+# instead of full library Member objects. Enable with COMPACT_MEMBER_CACHE=1 on large guilds.
+COMPACT_MEMBER_CACHE = os.getenv('COMPACT_MEMBER_CACHE', '0') == '1'
+
 # Set up the bot
-bot = commands.Bot(command_prefix="!", intents=intents)
+if COMPACT_MEMBER_CACHE:
+    bot = commands.Bot(command_prefix="!", intents=intents, member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False)
+    member_cache = CompactMemberCache()
+    install_compact_member_cache(bot, member_cache)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
+    member_cache = None
+# The role and channel commands are not added to the bot, so !help reads them from the server's command set
+bot.help_command = CommandSetHelpCommand()
+install_tracing(bot)
+
+# Memory budgets per cache, e.g. CACHE_BUDGETS="members=256MB,messages=8MB", checked every
+# CACHE_BUDGET_INTERVAL seconds. Caches over budget are evicted down to 90% of it.
+cache_budgets = CacheBudgets.from_config(os.getenv('CACHE_BUDGETS', ''))
+bot.cache_budgets = cache_budgets
+CACHE_BUDGET_INTERVAL = float(os.getenv('CACHE_BUDGET_INTERVAL', '60'))
+memory_snapshots = SnapshotStore()
 # Get bot token from environment variable
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN environment variable is not set")
 
+# Event loop watchdog settings (seconds)
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.5'))
+LOOP_TICK_INTERVAL = 0.1
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+
+# Commands currently being invoked, keyed by the message that triggered them
+running_commands = {}
+
+class LoopWatchdog:
+    """Measures event loop lag and samples the loop thread's stack from a background thread.
+    A background thread is needed because nothing on the loop itself can run while the loop is blocked."""
+
+    def __init__(self, loop, threshold):
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.threshold = threshold
+        self.last_tick = time.monotonic()
+        self.reported_tick = None
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.profile_lock = threading.Lock()
+        self.profile_samples = None
+        self.profile_stop = None
+        self.thread = threading.Thread(target=self.run, name="loop-watchdog", daemon=True)
+
+    def start(self):
+        self.loop.call_soon(self.tick)
+        self.thread.start()
+
+    def tick(self):
+        """Runs on the loop every LOOP_TICK_INTERVAL; any extra delay is loop lag."""
+        now = time.monotonic()
+        lag = now - self.last_tick - LOOP_TICK_INTERVAL
+        self.max_lag = max(self.max_lag, lag)
+        if lag > self.threshold:
+            print(f"Event loop lag: {lag:.2f}s")
+        self.last_tick = now
+        self.loop.call_later(LOOP_TICK_INTERVAL, self.tick)
+
+    def run(self):
+        while True:
+            time.sleep(PROFILE_SAMPLE_INTERVAL if self.profile_samples is not None else LOOP_TICK_INTERVAL / 2)
+            # An error must not end the thread, or lag detection stops for the rest of the process
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error in event loop watchdog: {e!r}")
+
+    def check(self):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+
+        with self.profile_lock:
+            if self.profile_samples is not None:
+                self.profile_samples[fold_stack(frame)] += 1
+
+        # Report each stall once, while the blocking code is still on the stack
+        last_tick = self.last_tick
+        lag = time.monotonic() - last_tick - LOOP_TICK_INTERVAL
+        if lag > self.threshold and self.reported_tick != last_tick:
+            self.reported_tick = last_tick
+            self.stalls += 1
+            command = find_command_in_stack(frame) or ", ".join(list(running_commands.values())) or "no command"
+            stack = "".join(traceback.format_stack(frame))
+            print(f"Event loop blocked for {lag:.2f}s+ while running {command}. Blocking stack:\n{stack}")
+
+    def start_profile(self):
+        """Starts sampling the loop thread. Called without awaiting after the profile_stop check, so two commands cannot both start one."""
+        self.profile_stop = asyncio.Event()
+        with self.profile_lock:
+            self.profile_samples = Counter()
+
+    async def profile(self, seconds):
+        """Waits for up to `seconds` (or until stop_profile) on a started profile and returns folded stack counts."""
+        try:
+            await asyncio.wait_for(self.profile_stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        with self.profile_lock:
+            samples, self.profile_samples = self.profile_samples, None
+        self.profile_stop = None
+        return samples
+
+    def stop_profile(self):
+        if self.profile_stop:
+            self.profile_stop.set()
+
+def fold_stack(frame):
+    """Formats a stack as "outer;inner;leaf" for flame graph tools (collapsed stack format)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+# Code object of each command callback -> command name. Rebuilt on the loop thread whenever commands are
+# loaded or reloaded, so the watchdog thread never iterates the live command dictionaries.
+command_callbacks = {}
+
+def refresh_command_callbacks():
+    global command_callbacks
+    commands_to_check = [*bot.walk_commands(), *all_set_commands()]
+    command_callbacks = {command.callback.__code__: command.qualified_name for command in commands_to_check}
+
+def find_command_in_stack(frame):
+    """Returns the name of the bot command whose callback is on the given stack, if any."""
+    callbacks = command_callbacks
+    while frame is not None:
+        if frame.f_code in callbacks:
+            return callbacks[frame.f_code]
+        frame = frame.f_back
+    return None
+
+loop_watchdog = None
+cache_budget_task = None
+
+async def enforce_cache_budgets():
+    while True:
+        await asyncio.sleep(CACHE_BUDGET_INTERVAL)
+        try:
+            evicted = cache_budgets.enforce(bot)
+            if any(evicted.values()):
+                print(f"Evicted to stay within cache budgets: {evicted}")
+        except Exception as e:
+            print(f"Error enforcing cache budgets: {e}")
+
+@bot.before_invoke
+async def track_command_start(ctx):
+    mark_arguments_parsed(ctx)
+    running_commands[ctx.message.id] = f"{ctx.command.qualified_name} (guild: {ctx.guild}, by: {ctx.author})"
+
+@bot.after_invoke
+async def track_command_end(ctx):
+    running_commands.pop(ctx.message.id, None)
+
 @bot.event
-async def on_ready():
-    print(f'Logged in as {bot.user}!')
-
-@bot.command()
-@commands.has_permissions(manage_roles=True)
-async def create_roles(ctx, *role_names):
-    """Creates multiple roles from a list of role names."""
-    try:
-        created_roles = []
-        for role_name in role_names:
-            new_role = await ctx.guild.create_role(name=role_name)
-            created_roles.append(new_role.name)
-
-        await ctx.send(f'Roles created successfully: {", ".join(created_roles)}')
-    except Exception as e:
-        await ctx.send(f'Error creating roles: {e}')
-
-
-@bot.command()
-@commands.has_permissions(manage_roles=True)
-async def delete_roles(ctx, *role_names):
-    """Deletes multiple roles from a list of role names."""
-    try:
-        if not role_names:
-            await ctx.send("No role names provided!")
-            return
-
-        deleted_roles = []
-        for role_name in role_names:
-            role = discord.utils.get(ctx.guild.roles, name=role_name)
-            if role:
-                await role.delete()
-                deleted_roles.append(role_name)
-                print(f"Deleted role: {role_name}")
-            else:
-                await ctx.send(f'Role not found: {role_name}')
-
-        if deleted_roles:
-            await ctx.send(f'Roles deleted successfully: {", ".join(deleted_roles)}')
-    except Exception as e:
-        await ctx.send(f'Error deleting roles: {e}')
-        print(f"Error: {e}")
-
-
-@bot.command()
-@commands.has_permissions(manage_roles=True)
-async def assignRole(ctx, role_name, *usernames):
-    """Assigns a specific role to a list of usernames."""
-    try:
-        role = discord.utils.get(ctx.guild.roles, name=role_name)
-        if not role:
-            await ctx.send(f'Role not found: {role_name}')
-            return
-
-        assigned_users = []
-        for username in usernames:
-            member = discord.utils.get(ctx.guild.members, name=username)
-            if member:
-                await member.add_roles(role)
-                assigned_users.append(username)
-                print(f"Assigned role {role_name} to {username}")
-            else:
-                await ctx.send(f'User not found: {username}')
-
-        if assigned_users:
-            await ctx.send(f'Role {role_name} assigned to: {", ".join(assigned_users)}')
-    except Exception as e:
-        await ctx.send(f'Error assigning role: {e}')
-        print(f"Error: {e}")
-
-@bot.command()
-@commands.has_permissions(manage_roles=True)
-async def remove_role(ctx, role_name, *usernames):
-    """Removes a specific role from a list of usernames."""
-    try:
-        role = discord.utils.get(ctx.guild.roles, name=role_name)
-        if not role:
-            await ctx.send(f'Role not found: {role_name}')
-            return
-
-        removed_users = []
-        for username in usernames:
-            member = discord.utils.get(ctx.guild.members, name=username)
-            if member:
-                await member.remove_roles(role)
-                removed_users.append(username)
-                print(f"Removed role {role_name} from {username}")
-            else:
-                await ctx.send(f'User not found: {username}')
-
-        if removed_users:
-            await ctx.send(f'Role {role_name} removed from: {", ".join(removed_users)}')
-    except Exception as e:
-        await ctx.send(f'Error removing role: {e}')
-        print(f"Error: {e}")
-
+async def on_message(message):
+    # Same as the default command processing, but each invocation is traced
+    if message.author.bot:
+        return
+    ctx = await bot.get_context(message)
+    if ctx.command is None and ctx.invoked_with:
+        # Role and channel commands come from the command set this server uses
+        ctx.command = find_command(message.guild, ctx.invoked_with)
+    with trace_command(ctx):
+        await bot.invoke(ctx)
+
+@bot.event
+async def setup_hook():
+    load_guild_command_sets()
+    for extension in EXTENSIONS.values():
+        await bot.load_extension(extension)
+    refresh_command_callbacks()
+
+@bot.event
+async def on_ready():
+    global loop_watchdog, cache_budget_task
+    print(f'Logged in as {bot.user}!')
+    # A new session fills the member caches again, so no member is evicted any more
+    cache_budgets.reset_evictions()
+    if loop_watchdog is None:
+        loop_watchdog = LoopWatchdog(asyncio.get_running_loop(), LOOP_LAG_THRESHOLD)
+        loop_watchdog.start()
+    if cache_budget_task is None:
+        cache_budget_task = asyncio.create_task(enforce_cache_budgets())
+
+@bot.listen("on_guild_join")
+@bot.listen("on_guild_remove")
+async def reset_guild_evictions(guild):
+    cache_budgets.reset_evictions(guild.id)
+
 @bot.command()
-@commands.has_permissions(manage_channels=True)
-async def add_roles_to_channels(ctx, *args):
-    """Adds role permissions to multiple channels. 
-    Usage: !add_roles_to_channels -r role1 role2 [-ch channel1 channel2]
-    If -ch is omitted, roles will be added to all channels below the command channel."""
+@commands.has_permissions(administrator=True)
+async def profile_loop(ctx, seconds: float = 30):
+    """Samples the event loop for a time window and uploads the stacks in collapsed (flame graph) format.
+    Run it again while a profile is active to stop early. Usage: !profile_loop [seconds]"""
     try:
-        roles = []
-        channel_names = []
-
-        # Parse arguments
-        args_list = list(args)
-        flag = None
-
-        for arg in args_list:
-            if arg.startswith("-"):
-                flag = arg
-            elif flag == "-r":
-                roles.append(arg)
-            elif flag == "-ch":
-                channel_names.append(arg)
-
-        if not roles:
-            await ctx.send("Please specify roles (-r). Example: !add_roles_to_channels -r role1 role2 [-ch channel1 channel2]")
+        if loop_watchdog is None:
+            await ctx.send("The event loop watchdog is not running yet.")
+            return
+        if loop_watchdog.profile_stop:
+            loop_watchdog.stop_profile()
+            await ctx.send("Stopping the active profile...")
             return
 
-        # Get role objects
-        role_objects = []
-        for role_name in roles:
-            role = discord.utils.get(ctx.guild.roles, name=role_name)
-            if role:
-                role_objects.append(role)
-            else:
-                await ctx.send(f'Role not found: {role_name}')
-                return
-
-        # Determine target channels
-        target_channels = []
-        command_channel = ctx.channel
-        
-        # Debug: Print command channel info
-        print(f"Command channel: {command_channel.name} (ID: {command_channel.id}, Position: {command_channel.position})")
-        
-        if channel_names:
-            # User specified channel names - find matching channels that are below the command channel
-            
-            # Get ALL text channels in the server and sort by position
-            all_guild_channels = list(ctx.guild.text_channels)
-            all_guild_channels.sort(key=lambda ch: ch.position)
-            
-            # Debug: Print all channels in the server
-            print(f"\nAll text channels in server (sorted by position):")
-            for i, ch in enumerate(all_guild_channels):
-                marker = " <- COMMAND CHANNEL" if ch == command_channel else ""
-                category_name = ch.category.name if ch.category else "No Category"
-                print(f"  Index {i}: {ch.name} (Category: {category_name}, Position: {ch.position}){marker}")
-            
-            # Find the index of the command channel
-            try:
-                command_index = all_guild_channels.index(command_channel)
-                print(f"\nCommand channel index in full server list: {command_index}")
-                # Get all channels after this index (below in the list)
-                channels_below = all_guild_channels[command_index + 1:]
-                print(f"Total channels below: {len(channels_below)}")
-            except ValueError:
-                channels_below = []
-                print("Command channel not found in guild channels")
-            
-            print(f"\nAll channels below command channel: {[ch.name for ch in channels_below]}")
-            
-            # Now filter for channels matching the specified names
-            for channel_name in channel_names:
-                matching_channels = [ch for ch in channels_below if ch.name == channel_name]
-                target_channels.extend(matching_channels)
-                print(f"Channels named '{channel_name}' below command channel: {[ch.name for ch in matching_channels]}")
-            
-            if not target_channels:
-                await ctx.send(f'No channels named {", ".join(channel_names)} found below the command channel.')
-                return
-                matching_channels = [ch for ch in channels_below if ch.name == channel_name]
-                target_channels.extend(matching_channels)
-                print(f"Channels named '{channel_name}' below command channel: {[ch.name for ch in matching_channels]}")
-            
-            if not target_channels:
-                await ctx.send(f'No channels named {", ".join(channel_names)} found below the command channel.')
-                return
-        else:
-            # No channels specified - use all channels below the command channel
-            if command_channel.category:
-                # In a category - get channels in same category, sort by position, then filter for those below
-                category_channels = [
-                    ch for ch in command_channel.category.channels 
-                    if isinstance(ch, discord.TextChannel)
-                ]
-                # Sort channels by position to get correct order
-                category_channels.sort(key=lambda ch: ch.position)
-                
-                # Debug: Print all channels in category with their positions
-                print(f"Category: {command_channel.category.name}")
-                for i, ch in enumerate(category_channels):
-                    marker = " <- COMMAND CHANNEL" if ch == command_channel else ""
-                    print(f"  Index {i}: {ch.name} (Position: {ch.position}){marker}")
-                
-                # Find the index of the command channel
-                try:
-                    command_index = category_channels.index(command_channel)
-                    print(f"Command channel index: {command_index}")
-                    # Get all channels after this index (below in the list)
-                    target_channels = category_channels[command_index + 1:]
-                    print(f"Target channels (below): {[ch.name for ch in target_channels]}")
-                except ValueError:
-                    target_channels = []
-                    print("Command channel not found in category channels")
-            else:
-                # Not in a category - get all channels below this position (that are also not in categories)
-                guild_channels = [
-                    ch for ch in ctx.guild.text_channels 
-                    if ch.category is None
-                ]
-                # Sort channels by position
-                guild_channels.sort(key=lambda ch: ch.position)
-                
-                # Debug: Print all channels
-                print("Channels outside categories:")
-                for i, ch in enumerate(guild_channels):
-                    marker = " <- COMMAND CHANNEL" if ch == command_channel else ""
-                    print(f"  Index {i}: {ch.name} (Position: {ch.position}){marker}")
-                
-                # Find the index of the command channel
-                try:
-                    command_index = guild_channels.index(command_channel)
-                    print(f"Command channel index: {command_index}")
-                    # Get all channels after this index
-                    target_channels = guild_channels[command_index + 1:]
-                    print(f"Target channels (below): {[ch.name for ch in target_channels]}")
-                except ValueError:
-                    target_channels = []
-                    print("Command channel not found in guild channels")
-            
-            if not target_channels:
-                await ctx.send("No channels found below the current channel.")
-                return
+        seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+        loop_watchdog.start_profile()
+        try:
+            await ctx.send(f'Profiling the event loop for {seconds:g}s (max lag so far: {loop_watchdog.max_lag:.2f}s, stalls: {loop_watchdog.stalls})...')
+        except Exception:
+            # Nobody would wait on the profile otherwise, so it would never end
+            loop_watchdog.stop_profile()
+            await loop_watchdog.profile(seconds)
+            raise
+        samples = await loop_watchdog.profile(seconds)
 
-        # Apply permissions to target channels
-        updated_channels = []
-        total_channels_updated = 0
-        
-        for channel in target_channels:
-            for role in role_objects:
-                await channel.set_permissions(role, view_channel=True, send_messages=True)
-                print(f"Added role {role.name} to channel {channel.name} (ID: {channel.id})")
-            updated_channels.append(channel.name)
-            total_channels_updated += 1
-
-        if updated_channels:
-            channel_list = ", ".join(updated_channels)
-            await ctx.send(f'Roles {", ".join(roles)} added to {total_channels_updated} channel(s): {channel_list}')
+        output = io.BytesIO()
+        for stack, count in samples.most_common():
+            output.write(f"{stack} {count}\n".encode("utf-8"))
+        output.seek(0)
+        await ctx.send(
+            f'Collected {sum(samples.values())} samples. Open the file with flamegraph.pl or speedscope.',
+            file=discord.File(output, filename="loop_profile.folded"),
+        )
+        print(f"Event loop profile finished: {sum(samples.values())} samples")
     except Exception as e:
-        await ctx.send(f'Error adding roles to channels: {e}')
+        await ctx.send(f'Error profiling event loop: {e}')
         print(f"Error: {e}")
 
 @bot.command()
-@commands.has_permissions(manage_channels=True)
-async def delete_roles_from_channels(ctx, *args):
-    """Removes role permissions from multiple channels. Usage: !delete_roles_from_channels -r role1 role2 -ch channel1 channel2"""
+@commands.has_permissions(administrator=True)
+async def reload(ctx, *set_names):
+    """Reloads command extensions in place, keeping the gateway connection and caches.
+    Usage: !reload [stable] [beta] (all command sets if none are given)"""
     try:
-        roles = []
-        channel_names = []
-
-        # Parse arguments
-        args_list = list(args)
-        flag = None
-
-        for arg in args_list:
-            if arg.startswith("-"):
-                flag = arg
-            elif flag == "-r":
-                roles.append(arg)
-            elif flag == "-ch":
-                channel_names.append(arg)
-
-        if not roles or not channel_names:
-            await ctx.send("Please specify roles (-r) and channels (-ch). Example: !delete_roles_from_channels -r role1 -ch announcement discussion")
+        set_names = set_names or tuple(EXTENSIONS)
+        unknown = [name for name in set_names if name not in EXTENSIONS]
+        if unknown:
+            await ctx.send(f'Unknown command set(s): {", ".join(unknown)}. Available: {", ".join(EXTENSIONS)}')
             return
 
-        # Get role objects
-        role_objects = []
-        for role_name in roles:
-            role = discord.utils.get(ctx.guild.roles, name=role_name)
-            if role:
-                role_objects.append(role)
-            else:
-                await ctx.send(f'Role not found: {role_name}')
-                return
-
-        # Process each channel (handle multiple channels with same name)
-        updated_channel_names = []
-        not_found_channels = []
-        total_channels_updated = 0
-        
-        for channel_name in channel_names:
-            # Find all channels with this name
-            matching_channels = [ch for ch in ctx.guild.channels if ch.name == channel_name]
-            
-            if matching_channels:
-                for channel in matching_channels:
-                    for role in role_objects:
-                        await channel.set_permissions(role, overwrite=None)
-                        print(f"Removed role {role.name} from channel {channel_name} (ID: {channel.id})")
-                    total_channels_updated += 1
-                updated_channel_names.append(f"{channel_name} ({len(matching_channels)} channel(s))")
-            else:
-                not_found_channels.append(channel_name)
+        results = []
+        for name in set_names:
+            start = time.perf_counter()
+            try:
+                # On failure the library keeps the previously loaded version of the extension
+                await bot.reload_extension(EXTENSIONS[name])
+            except commands.ExtensionNotLoaded:
+                await bot.load_extension(EXTENSIONS[name])
+            except commands.ExtensionError as e:
+                results.append(f'{name}: failed, still running the previous version ({e.__cause__ or e})')
+                print(f"Error reloading {EXTENSIONS[name]}:")
+                traceback.print_exception(e.__cause__ or e)
+                continue
+            command_count = len(set(command_sets.get(name, {}).values()))
+            results.append(f'{name}: reloaded {command_count} command(s) in {(time.perf_counter() - start) * 1000:.0f} ms')
+            print(f"Reloaded {EXTENSIONS[name]}")
 
-        if updated_channel_names:
-            await ctx.send(f'Roles {", ".join(roles)} removed from: {", ".join(updated_channel_names)} - Total: {total_channels_updated} channel(s) updated')
-        if not_found_channels:
-            await ctx.send(f'Channels not found: {", ".join(not_found_channels)}')
+        refresh_command_callbacks()
+        await ctx.send("\n".join(results))
     except Exception as e:
-        await ctx.send(f'Error removing roles from channels: {e}')
+        await ctx.send(f'Error reloading commands: {e}')
         print(f"Error: {e}")
 
 @bot.command()
-@commands.has_permissions(manage_channels=True)
-async def remove_messaging_permissions(ctx, *args):
-    """Makes specified channels read-only for a given role (removes send/thread permissions, keeps view permission).
-    Only modifies channels where the role already has explicit permissions.
-    Supports duplicate channel names - will update all channels with the same name.
-    Usage: !remove_messaging_permissions -r role_name -ch channel1 channel2
-    Example: !remove_messaging_permissions -r Student -ch announcement general-info"""
+@commands.has_permissions(administrator=True)
+async def command_set(ctx, set_name=None):
+    """Shows or selects the command set (stable or beta) used in this server. Usage: !command_set [stable|beta]"""
     try:
-        role_name = None
-        channel_names = []
-
-        # Parse arguments
-        args_list = list(args)
-        flag = None
-
-        for arg in args_list:
-            if arg.startswith("-"):
-                flag = arg
-            elif flag == "-r":
-                role_name = arg
-                flag = None  # Only take first role name
-            elif flag == "-ch":
-                channel_names.append(arg)
-
-        if not role_name or not channel_names:
-            await ctx.send("Please specify a role (-r) and channels (-ch). Example: !remove_messaging_permissions -r Student -ch announcement")
+        if set_name is None:
+            await ctx.send(f'This server uses the {command_set_for(ctx.guild)} command set. Available: {", ".join(EXTENSIONS)}')
             return
-
-        # Get role object
-        role = discord.utils.get(ctx.guild.roles, name=role_name)
-        if not role:
-            await ctx.send(f'Role not found: {role_name}')
+        if set_name not in EXTENSIONS:
+            await ctx.send(f'Unknown command set: {set_name}. Available: {", ".join(EXTENSIONS)}')
             return
 
-        # Process each channel name (handle multiple channels with same name)
-        updated_channels = []
-        skipped_channels = []
-        not_found_channels = set()
-        total_channels_updated = 0
-        
-        for channel_name in channel_names:
-            # Find all text channels with this name
-            matching_channels = [ch for ch in ctx.guild.text_channels if ch.name == channel_name]
-            
-            if not matching_channels:
-                not_found_channels.add(channel_name)
-                continue
-            
-            for channel in matching_channels:
-                # Check if role has explicit permissions in this channel
-                role_overwrite = channel.overwrites_for(role)
-                
-                # Check if the role has any explicit permissions set (not default/None)
-                has_explicit_perms = any([
-                    role_overwrite.view_channel is not None,
-                    role_overwrite.send_messages is not None,
-                    role_overwrite.create_public_threads is not None,
-                    role_overwrite.create_private_threads is not None,
-                    role_overwrite.send_messages_in_threads is not None
-                ])
-                
-                if has_explicit_perms:
-                    # Role has explicit permissions, keep view_channel but deny messaging
-                    # Get current overwrites to preserve view_channel setting
-                    current_overwrites = channel.overwrites_for(role)
-                    
-                    await channel.set_permissions(
-                        role,
-                        view_channel=current_overwrites.view_channel if current_overwrites.view_channel is not None else True,
-                        send_messages=False,
-                        create_public_threads=False,
-                        create_private_threads=False,
-                        send_messages_in_threads=False
-                    )
-                    updated_channels.append(f"{channel.name} (ID: {channel.id})")
-                    total_channels_updated += 1
-                    print(f"Made channel {channel.name} (ID: {channel.id}) read-only for role {role.name}")
-                else:
-                    # Role doesn't have explicit permissions, skip it
-                    skipped_channels.append(f"{channel.name} (ID: {channel.id})")
-                    print(f"Skipped channel {channel.name} (ID: {channel.id}) - role {role.name} has no explicit permissions")
-
-        # Send feedback
-        response_parts = []
-        
-        if updated_channels:
-            response_parts.append(f'Made {total_channels_updated} channel(s) read-only for role "{role_name}": {", ".join(updated_channels)}')
-        
-        if skipped_channels:
-            response_parts.append(f'Skipped {len(skipped_channels)} channel(s) where role has no explicit permissions: {", ".join(skipped_channels)}')
-        
-        if not_found_channels:
-            response_parts.append(f'Channels not found: {", ".join(not_found_channels)}')
-        
-        if not response_parts:
-            await ctx.send(f'No channels were updated.')
-        else:
-            # Send response in chunks if too long
-            full_response = '\n'.join(response_parts)
-            if len(full_response) > 2000:
-                for part in response_parts:
-                    await ctx.send(part)
-            else:
-                await ctx.send(full_response)
-                
+        set_guild_command_set(ctx.guild.id, set_name)
+        await ctx.send(f'This server now uses the {set_name} command set.')
+        print(f"Command set for {ctx.guild.name}: {set_name}")
     except Exception as e:
-        await ctx.send(f'Error making channels read-only: {e}')
+        await ctx.send(f'Error selecting command set: {e}')
         print(f"Error: {e}")
 
 @bot.command()
-@commands.has_permissions(manage_channels=True)
-async def create_categories_with_channels(ctx, *args):
-    """Creates multiple categories with specific channels accessible only to specific roles."""
+@commands.has_permissions(administrator=True)
+async def memory(ctx, action=None, *args):
+    """Reports memory use per cache, takes and compares tracemalloc snapshots and sets cache budgets.
+    Usage: !memory | !memory snapshot [label] | !memory diff [old] [new] | !memory stop
+    | !memory budget [members|messages] [size|off] | !memory evict"""
     try:
-        categories = []
-        roles = []
-        channels = []
-
-        # Use a more robust argument parsing method
-        args_list = list(args)
-        flag = None
-
-        for arg in args_list:
-            if arg.startswith("-"):
-                flag = arg
-            elif flag == "-m":
-                categories.append(arg)
-            elif flag == "-r":
-                roles.append(arg)
-            elif flag == "-ch":
-                channels.append(arg)
-
-        if not categories or not roles or not channels:
-            await ctx.send("Please specify categories (-m), roles (-r), and channels (-ch). Example: !create_categories_with_channels -m Category1 Category2 -r Role1 Role2 -ch Channel1 Channel2")
-            return
-
-        for category_name in categories:
-            # Create overwrites for the specified roles
-            overwrites = {
-                ctx.guild.default_role: discord.PermissionOverwrite(view_channel=False)
-            }
-            for role_name in roles:
-                role = discord.utils.get(ctx.guild.roles, name=role_name)
-                if role:
-                    overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+        if action is None:
+            breakdown = cache_breakdown(bot, {
+                "overwrite index": role_overwrite_index,
+                "in-flight operations": in_flight_operations,
+                "pending plans": pending_plans,
+            })
+            lines = [f'{"Cache":<22}{"Objects":>10}{"Est. size":>12}{"Budget":>12}']
+            # With the compact member cache enabled, the members budget applies to it instead
+            member_row = "compact members" if "compact members" in breakdown else "members"
+            for name, (count, size) in breakdown.items():
+                if name in ("members", "compact members"):
+                    budget = cache_budgets.budgets.get("members") if name == member_row else None
                 else:
-                    await ctx.send(f'Role not found: {role_name}')
+                    budget = cache_budgets.budgets.get(name)
+                lines.append(f'{name:<22}{count:>10}{format_size(size):>12}{format_size(budget) if budget else "-":>12}')
+            rss = rss_bytes()
+            lines.append("")
+            lines.append(f'RSS: {format_size(rss) if rss else "unknown"}, evicted so far: {cache_budgets.evicted}')
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                lines.append(f'tracemalloc: {format_size(current)} traced (peak {format_size(peak)}), snapshots: {", ".join(memory_snapshots.snapshots) or "none"}')
+            else:
+                lines.append("tracemalloc: off (starts with !memory snapshot)")
+            await ctx.send("```\n" + "\n".join(lines)[:1980] + "\n```")
+
+        elif action == "snapshot":
+            label, snapshot = await memory_snapshots.take(args[0] if args else None)
+            top = format_statistics(snapshot.statistics("lineno"), 10)
+            message = f'Snapshot {label} taken. Allocations made before the first snapshot are not traced.\nTop allocations:\n'
+            await ctx.send((message + "```\n" + "\n".join(top))[:1990] + "\n```")
+            print(f"Took tracemalloc snapshot {label}")
+
+        elif action == "diff":
+            labels = list(memory_snapshots.snapshots)
+            if len(args) >= 2:
+                old_label, new_label = args[0], args[1]
+            else:
+                # Compare a snapshot (default: the latest) with one taken now
+                if not labels:
+                    await ctx.send("No snapshot to compare with. Take one with !memory snapshot first.")
                     return
+                old_label = args[0] if args else labels[-1]
+                new_label, _ = await memory_snapshots.take()
+            missing = [label for label in (old_label, new_label) if label not in memory_snapshots.snapshots]
+            if missing:
+                await ctx.send(f'Unknown snapshot(s): {", ".join(missing)}. Available: {", ".join(memory_snapshots.snapshots) or "none"}')
+                return
+            diff = format_statistics(await memory_snapshots.diff(old_label, new_label), 10)
+            await ctx.send((f'Largest changes from {old_label} to {new_label}:\n```\n' + "\n".join(diff))[:1990] + "\n```")
 
-            # Create the category
-            category = await ctx.guild.create_category(category_name, overwrites=overwrites)
-            print(f"Created category: {category_name}")
+        elif action == "stop":
+            memory_snapshots.stop()
+            await ctx.send("Stopped tracemalloc and dropped all snapshots.")
 
-            # Create channels within the category
-            created_channels = []
-            for channel_name in channels:
-                channel = await category.create_text_channel(channel_name)
-                created_channels.append(channel.name)
-                print(f"Created channel: {channel_name} in category {category_name}")
+        elif action == "budget":
+            if len(args) >= 2:
+                cache_budgets.set_budget(args[0], None if args[1] == "off" else parse_size(args[1]))
+                cache_budgets.restore_message_cache(bot)
+                print(f"Cache budget for {args[0]}: {args[1]}")
+            budgets = ", ".join(f"{name}={format_size(size)}" for name, size in cache_budgets.budgets.items())
+            await ctx.send(f'Cache budgets: {budgets or "none"}')
 
-            await ctx.send(f'Category "{category_name}" with channels "{", ".join(created_channels)}" created for roles "{", ".join(roles)}".')
+        elif action == "evict":
+            evicted = cache_budgets.enforce(bot)
+            if any(evicted.values()):
+                await ctx.send(f'Evicted: {", ".join(f"{count} {name}" for name, count in evicted.items())}')
+            else:
+                await ctx.send("All caches are within their budgets.")
+
+        else:
+            await ctx.send("Unknown action. Usage: !memory [snapshot|diff|stop|budget|evict]")
+    except ValueError as e:
+        await ctx.send(f'Invalid memory command: {e}')
     except Exception as e:
-        await ctx.send(f'Error creating categories or channels: {e}')
+        await ctx.send(f'Error reporting memory: {e}')
         print(f"Error: {e}")
-
-# Run the bot
-bot.run(BOT_TOKEN)
+
+# Run the bot
+if __name__ == "__main__":
+    bot.run(BOT_TOKEN)
@@ -0,0 +1,1121 @@
+import discord
+from discord.ext import commands
+from discord.http import Route
+import asyncio
+import contextlib
+import aiohttp
+import codecs
+import csv
+import functools
+import io
+import math
+import tempfile
+import time
+from collections import Counter
+from command_sets import register_command_set, unregister_command_set
+from member_cache import add_member_roles, member_has_role, remove_member_roles, resolve_members
+from tracing import trace_span
+from extensions.state import in_flight_operations, pending_plans, role_overwrite_index
+
+# Commands of the stable set, loaded by dosi.py as an extension and swapped in place by !reload
+COMMAND_SET = "stable"
+
+# Set by setup() when the extension is loaded. Members are resolved through member_cache.resolve_members,
+# which uses the compact member cache and the cache budgets the bot has.
+bot = None
+
+# Roster attachments are downloaded and parsed in chunks so large files never sit in memory at once
+ROSTER_CHUNK_SIZE = 64 * 1024
+ROSTER_BATCH_SIZE = 500
+ROSTER_HEADER_NAMES = {"user", "username", "name", "member"}
+
+def parse_roster_lines(lines):
+    """Parses CSV or plain newline roster lines into (username, role_name) pairs."""
+    for row in csv.reader(lines):
+        if not row or not row[0].strip():
+            continue
+        username = row[0].strip()
+        role_name = row[1].strip() if len(row) > 1 and row[1].strip() else None
+        yield username, role_name
+
+async def iter_roster_rows(attachment):
+    """Streams an attached roster and yields (username, role_name) pairs without reading the whole file.
+    Only the first row can be a header; later rows named like a header column are real usernames."""
+    first_row = True
+    async for lines in iter_roster_lines(attachment):
+        for username, role_name in parse_roster_lines(lines):
+            if first_row:
+                first_row = False
+                if username.lower() in ROSTER_HEADER_NAMES:
+                    continue
+            yield username, role_name
+
+async def iter_roster_lines(attachment):
+    """Downloads an attached roster in chunks and yields lists of complete lines."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(attachment.url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(ROSTER_CHUNK_SIZE):
+                pending += decoder.decode(chunk)
+                *lines, pending = pending.split("\n")
+                yield lines
+    pending += decoder.decode(b"", final=True)
+    yield pending.split("\n")
+
+@contextlib.contextmanager
+def claim_in_flight(keys):
+    """Registers every key no other command is working on, before the first REST call is made.
+    Yields (claimed, waiting): claimed maps each registered key to its future, waiting holds the futures
+    of keys another command registered first. Finish each claimed key with finish_in_flight as soon as
+    its call is done; keys still registered when the block exits are released as failed."""
+    loop = asyncio.get_running_loop()
+    claimed = {}
+    waiting = []
+    for key in dict.fromkeys(keys):
+        existing = in_flight_operations.get(key)
+        if existing is not None:
+            waiting.append(existing)
+        else:
+            claimed[key] = in_flight_operations[key] = loop.create_future()
+    try:
+        yield claimed, waiting
+    finally:
+        for key in list(claimed):
+            finish_in_flight(claimed, key, False)
+
+def finish_in_flight(claimed, key, succeeded):
+    """Releases a claimed key; commands waiting on it get whether the call succeeded."""
+    future = claimed.pop(key)
+    if in_flight_operations.get(key) is future:
+        del in_flight_operations[key]
+    if not future.done():
+        future.set_result(succeeded)
+
+async def wait_for_in_flight(ctx, waiting):
+    """Waits for operations another command already started and reports them instead of repeating them."""
+    if not waiting:
+        return
+    results = await asyncio.gather(*set(waiting))
+    failed = results.count(False)
+    message = f'{len(waiting)} update(s) were already in progress from another command and were not sent again.'
+    if failed:
+        message += f' {failed} of those operation(s) failed; run the command again to retry them.'
+    await ctx.send(message)
+
+async def apply_roster_batch(ctx, batch, roles_by_name, add, stats):
+    """Resolves one batch of roster rows and adds or removes their roles with one call per member."""
+    members = await resolve_members(bot, ctx.guild, [username for username, _ in batch])
+
+    # Group the rows by member so each member gets a single request
+    changes = {}
+    for username, role_name in batch:
+        member = members.get(username)
+        if not member:
+            stats["not_found_users"] += 1
+            if len(stats["missing_users"]) < 20:
+                stats["missing_users"].append(username)
+            continue
+        if role_name not in roles_by_name:
+            with trace_span("resolve_names"):
+                roles_by_name[role_name] = discord.utils.get(ctx.guild.roles, name=role_name)
+        role = roles_by_name[role_name]
+        if not role:
+            stats["not_found_roles"].add(role_name)
+            continue
+        changes.setdefault(member, set()).add(role)
+
+    operation = "add_role" if add else "remove_role"
+    member_keys = {}
+    for member, roles in changes.items():
+        member_keys[member] = {
+            (ctx.guild.id, operation, member.id, role.id): role
+            for role in roles
+            if member_has_role(member, role) != add
+        }
+
+    # Claim the whole batch up front, so a duplicate command only sends the changes this one is not making
+    with claim_in_flight(key for keys in member_keys.values() for key in keys) as (claimed, waiting):
+        stats["waiting"].extend(waiting)
+        for member, keys in member_keys.items():
+            roles = [role for key, role in keys.items() if key in claimed]
+            if not roles:
+                stats["unchanged"] += 1
+                continue
+            try:
+                if add:
+                    await add_member_roles(bot, ctx.guild, member, roles)
+                else:
+                    await remove_member_roles(bot, ctx.guild, member, roles)
+                succeeded = True
+                stats["updated"] += 1
+            except discord.HTTPException as e:
+                succeeded = False
+                stats["failed"] += 1
+                print(f"Error updating roles for {member.name}: {e}")
+            for key in keys:
+                if key in claimed:
+                    finish_in_flight(claimed, key, succeeded)
+
+async def apply_role_to_usernames(ctx, role, usernames, add):
+    """Adds or removes one role for the users named in a command.
+    Returns (updated usernames, usernames already in the wanted state, futures of operations another command is running)."""
+    usernames = list(dict.fromkeys(usernames))
+    members = await resolve_members(bot, ctx.guild, usernames)
+    for username in usernames:
+        if username not in members:
+            await ctx.send(f'User not found: {username}')
+
+    operation = "add_role" if add else "remove_role"
+    targets = {}
+    unchanged_users = []
+    for username, member in members.items():
+        if member_has_role(member, role) == add:
+            unchanged_users.append(username)
+        else:
+            targets[(ctx.guild.id, operation, member.id, role.id)] = (username, member)
+
+    updated_users = []
+    # Claim every target up front, so a duplicate command only sends the changes this one is not making
+    with claim_in_flight(targets) as (claimed, waiting):
+        for key, (username, member) in targets.items():
+            if key not in claimed:
+                continue
+            if add:
+                await add_member_roles(bot, ctx.guild, member, [role])
+                print(f"Assigned role {role.name} to {username}")
+            else:
+                await remove_member_roles(bot, ctx.guild, member, [role])
+                print(f"Removed role {role.name} from {username}")
+            finish_in_flight(claimed, key, True)
+            updated_users.append(username)
+    return updated_users, unchanged_users, waiting
+
+async def apply_roster_attachment(ctx, attachment, default_role_name, add):
+    """Bulk adds or removes roles for every user listed in an attached CSV or newline roster.
+    Each row is "username" or "username,role"; rows without a role use the role given in the command."""
+    action = "Assigning" if add else "Removing"
+    stats = {
+        "rows": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "failed": 0,
+        "not_found_users": 0,
+        "missing_users": [],
+        "not_found_roles": set(),
+        "rows_without_role": 0,
+        "waiting": [],
+    }
+    roles_by_name = {}
+    progress = await ctx.send(f'{action} roles from {attachment.filename}...')
+
+    batch = []
+    async for username, role_name in iter_roster_rows(attachment):
+        role_name = role_name or default_role_name
+        if not role_name:
+            stats["rows_without_role"] += 1
+            continue
+        batch.append((username, role_name))
+        stats["rows"] += 1
+        if len(batch) >= ROSTER_BATCH_SIZE:
+            await apply_roster_batch(ctx, batch, roles_by_name, add, stats)
+            batch = []
+            await progress.edit(content=f'{action} roles from {attachment.filename}: {stats["rows"]} row(s) processed, {stats["updated"]} member(s) updated...')
+    if batch:
+        await apply_roster_batch(ctx, batch, roles_by_name, add, stats)
+
+    summary = [f'Processed {stats["rows"]} row(s) from {attachment.filename}: {stats["updated"]} member(s) updated, {stats["unchanged"]} already up to date.']
+    if stats["failed"]:
+        summary.append(f'Failed to update {stats["failed"]} member(s).')
+    if stats["not_found_users"]:
+        summary.append(f'Users not found ({stats["not_found_users"]}): {", ".join(stats["missing_users"])}' + (" ..." if stats["not_found_users"] > len(stats["missing_users"]) else ""))
+    if stats["rows_without_role"]:
+        summary.append(f'Skipped {stats["rows_without_role"]} row(s) with no role; give a role in the command or a second column.')
+    if stats["not_found_roles"]:
+        summary.append(f'Roles not found: {", ".join(sorted(stats["not_found_roles"]))}'[:1000])
+    await progress.edit(content='\n'.join(summary)[:2000])
+    await wait_for_in_flight(ctx, stats["waiting"])
+    print(f"{action} roles from roster {attachment.filename}: {stats['rows']} rows, {stats['updated']} updated")
+
+# Member exports page through the raw REST member list instead of building Member objects
+EXPORT_PAGE_SIZE = 1000
+EXPORT_SPOOL_SIZE = 1024 * 1024
+
+async def iter_member_pages(guild):
+    """Yields pages of raw member payloads for a guild, EXPORT_PAGE_SIZE members at a time."""
+    after = None
+    while True:
+        page = await bot.http.get_members(guild.id, limit=EXPORT_PAGE_SIZE, after=after)
+        if not page:
+            return
+        yield page
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after = page[-1]["user"]["id"]
+
+async def write_role_members_csv(guild, roles, fp):
+    """Writes one "username,role,user_id,nickname" row per member and exported role into a binary file.
+    The first two columns use the same format as roster attachments for !assignRole."""
+    roles_by_id = {str(role.id): role for role in roles}
+    counts = {role.name: 0 for role in roles}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["username", "role", "user_id", "nickname"])
+    async for page in iter_member_pages(guild):
+        for data in page:
+            for role_id in data.get("roles", []):
+                role = roles_by_id.get(role_id)
+                if role:
+                    user = data["user"]
+                    writer.writerow([user["username"], role.name, user["id"], data.get("nick") or ""])
+                    counts[role.name] += 1
+        # Flush each page to the spooled file so only one page of text is held at a time
+        fp.write(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+    return counts
+
+def index_channel(channel):
+    for target in channel.overwrites:
+        if isinstance(target, discord.Role):
+            role_overwrite_index.setdefault(target.id, set()).add(channel.id)
+
+def unindex_channel(channel):
+    for target in channel.overwrites:
+        channel_ids = role_overwrite_index.get(target.id)
+        if channel_ids is not None:
+            channel_ids.discard(channel.id)
+            if not channel_ids:
+                del role_overwrite_index[target.id]
+
+def index_guild(guild):
+    """Adds every channel of a guild to the overwrite index."""
+    for channel in guild.channels:
+        index_channel(channel)
+
+def channels_with_overwrites(guild, role):
+    """Returns the channels where the role has a permission overwrite, using the inverted index."""
+    channels = []
+    for channel_id in list(role_overwrite_index.get(role.id, ())):
+        channel = guild.get_channel(channel_id)
+        if channel:
+            channels.append(channel)
+    return channels
+
+# Dry runs build the exact list of REST calls a command would make; !confirm runs a stored plan
+PLAN_TTL = 300
+# Assumed bucket for routes the bot has not called yet (requests per window, window in seconds)
+DEFAULT_BUCKET_LIMIT = 5
+DEFAULT_BUCKET_WINDOW = 5.0
+GLOBAL_RATE_LIMIT = 50
+
+class PlanStepFailed(Exception):
+    """Raised by a planned call that cannot run because an earlier step it depends on failed."""
+
+def plan_call(route, description, run):
+    """A planned REST call: the route decides its rate limit bucket, run() performs it."""
+    return {"route": route, "description": description, "run": run}
+
+def grants_channel_access(channel, role):
+    """True if the role's overwrite in the channel is already exactly what add_roles_to_channels sets."""
+    return channel.overwrites_for(role) == discord.PermissionOverwrite(view_channel=True, send_messages=True)
+
+def estimate_plan_seconds(plan):
+    """Estimates how long the plan takes to run from the bot's current rate limit bucket state."""
+    # The HTTP client keeps its buckets privately; unknown routes fall back to the default bucket
+    buckets = getattr(bot.http, "_buckets", {})
+    bucket_hashes = getattr(bot.http, "_bucket_hashes", {})
+    now = asyncio.get_running_loop().time()
+
+    calls_per_bucket = Counter((call["route"].key, call["route"].major_parameters) for call in plan)
+    wait = 0.0
+    for (route_key, major_parameters), count in calls_per_bucket.items():
+        bucket = buckets.get(f'{bucket_hashes.get(route_key, route_key)}:{major_parameters}')
+        if bucket is not None and bucket.expires is not None and not bucket.is_expired():
+            limit = bucket.limit
+            remaining = bucket.remaining
+            window = bucket.reset_after or DEFAULT_BUCKET_WINDOW
+            first_wait = bucket.expires - now
+        else:
+            limit = remaining = DEFAULT_BUCKET_LIMIT
+            window = first_wait = DEFAULT_BUCKET_WINDOW
+        over = count - remaining
+        if over > 0:
+            wait += first_wait + (math.ceil(over / limit) - 1) * window
+
+    latency = bot.latency if math.isfinite(bot.latency) else 0.1
+    return max(len(plan) * latency + wait, len(plan) / GLOBAL_RATE_LIMIT)
+
+async def report_plan(ctx, command_name, plan, skipped, permissions):
+    """Reports a dry run and keeps the plan so !confirm can run it without resolving again.
+    permissions are the ones the command requires; !confirm checks them again before running the plan."""
+    lines = [f'Dry run of {command_name}: {len(plan)} REST call(s), {len(skipped)} skipped as no-ops, estimated time ~{estimate_plan_seconds(plan):.1f}s.']
+    lines += [f'- {call["description"]}' for call in plan[:20]]
+    if len(plan) > 20:
+        lines.append(f'- ... and {len(plan) - 20} more')
+    if skipped:
+        lines.append(f'Skipped: {", ".join(skipped[:20])}' + (" ..." if len(skipped) > 20 else ""))
+    if plan:
+        now = time.monotonic()
+        for key in [key for key, pending in pending_plans.items() if now - pending["created"] > PLAN_TTL]:
+            del pending_plans[key]
+        pending_plans[(ctx.guild.id, ctx.author.id)] = {"command": command_name, "plan": plan, "permissions": permissions, "created": now}
+        lines.append(f'Run !confirm within {PLAN_TTL // 60} minutes to execute this plan.')
+    await ctx.send('\n'.join(lines)[:2000])
+
+async def build_overwrite_index():
+    role_overwrite_index.clear()
+    for guild in bot.guilds:
+        index_guild(guild)
+    print(f"Indexed overwrites for {len(role_overwrite_index)} role(s)")
+
+async def index_joined_guild(guild):
+    index_guild(guild)
+
+async def unindex_removed_guild(guild):
+    for role in guild.roles:
+        role_overwrite_index.pop(role.id, None)
+
+async def index_created_channel(channel):
+    index_channel(channel)
+
+async def reindex_updated_channel(before, after):
+    unindex_channel(before)
+    index_channel(after)
+
+async def unindex_deleted_channel(channel):
+    unindex_channel(channel)
+
+async def unindex_deleted_role(role):
+    role_overwrite_index.pop(role.id, None)
+
+@commands.command()
+@commands.has_permissions(manage_roles=True)
+async def create_roles(ctx, *role_names):
+    """Creates multiple roles from a list of role names."""
+    try:
+        created_roles = []
+        for role_name in role_names:
+            new_role = await ctx.guild.create_role(name=role_name)
+            created_roles.append(new_role.name)
+
+        await ctx.send(f'Roles created successfully: {", ".join(created_roles)}')
+    except Exception as e:
+        await ctx.send(f'Error creating roles: {e}')
+
+
+@commands.command()
+@commands.has_permissions(manage_roles=True)
+async def delete_roles(ctx, *role_names):
+    """Deletes multiple roles from a list of role names. Add --dry-run to only report the planned calls."""
+    try:
+        dry_run = "--dry-run" in role_names
+        role_names = [role_name for role_name in role_names if role_name != "--dry-run"]
+        if not role_names:
+            await ctx.send("No role names provided!")
+            return
+
+        if dry_run:
+            plan = []
+            skipped = []
+            not_found = []
+            for role_name in dict.fromkeys(role_names):
+                with trace_span("resolve_names"):
+                    role = discord.utils.get(ctx.guild.roles, name=role_name)
+                if not role:
+                    not_found.append(role_name)
+                elif role.is_default() or role.managed:
+                    skipped.append(f"{role_name} (cannot be deleted)")
+                else:
+                    route = Route('DELETE', '/guilds/{guild_id}/roles/{role_id}', guild_id=ctx.guild.id, role_id=role.id)
+                    plan.append(plan_call(route, f"Delete role {role_name}", role.delete))
+            if not_found:
+                await ctx.send(f'Roles not found: {", ".join(not_found)}')
+            await report_plan(ctx, "delete_roles", plan, skipped, ["manage_roles"])
+            return
+
+        deleted_roles = []
+        for role_name in role_names:
+            with trace_span("resolve_names"):
+                role = discord.utils.get(ctx.guild.roles, name=role_name)
+            if role:
+                await role.delete()
+                deleted_roles.append(role_name)
+                print(f"Deleted role: {role_name}")
+            else:
+                await ctx.send(f'Role not found: {role_name}')
+
+        if deleted_roles:
+            await ctx.send(f'Roles deleted successfully: {", ".join(deleted_roles)}')
+    except Exception as e:
+        await ctx.send(f'Error deleting roles: {e}')
+        print(f"Error: {e}")
+
+
+@commands.command()
+@commands.has_permissions(manage_roles=True)
+async def assignRole(ctx, role_name=None, *usernames):
+    """Assigns a specific role to a list of usernames.
+    Attach a CSV or newline list of users (optionally "username,role") to assign roles in bulk."""
+    try:
+        if ctx.message.attachments:
+            await apply_roster_attachment(ctx, ctx.message.attachments[0], role_name, add=True)
+            return
+        if not role_name:
+            await ctx.send("Please specify a role and users, or attach a roster file. Example: !assignRole Admin John Jane")
+            return
+
+        with trace_span("resolve_names"):
+            role = discord.utils.get(ctx.guild.roles, name=role_name)
+        if not role:
+            await ctx.send(f'Role not found: {role_name}')
+            return
+
+        assigned_users, unchanged_users, waiting = await apply_role_to_usernames(ctx, role, usernames, add=True)
+        if assigned_users:
+            await ctx.send(f'Role {role_name} assigned to: {", ".join(assigned_users)}')
+        if unchanged_users:
+            await ctx.send(f'Already had role {role_name}: {", ".join(unchanged_users)}'[:2000])
+        await wait_for_in_flight(ctx, waiting)
+    except Exception as e:
+        await ctx.send(f'Error assigning role: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_roles=True)
+async def remove_role(ctx, role_name=None, *usernames):
+    """Removes a specific role from a list of usernames.
+    Attach a CSV or newline list of users (optionally "username,role") to remove roles in bulk."""
+    try:
+        if ctx.message.attachments:
+            await apply_roster_attachment(ctx, ctx.message.attachments[0], role_name, add=False)
+            return
+        if not role_name:
+            await ctx.send("Please specify a role and users, or attach a roster file. Example: !remove_role Moderator John Jane")
+            return
+
+        with trace_span("resolve_names"):
+            role = discord.utils.get(ctx.guild.roles, name=role_name)
+        if not role:
+            await ctx.send(f'Role not found: {role_name}')
+            return
+
+        removed_users, unchanged_users, waiting = await apply_role_to_usernames(ctx, role, usernames, add=False)
+        if removed_users:
+            await ctx.send(f'Role {role_name} removed from: {", ".join(removed_users)}')
+        if unchanged_users:
+            await ctx.send(f'Did not have role {role_name}: {", ".join(unchanged_users)}'[:2000])
+        await wait_for_in_flight(ctx, waiting)
+    except Exception as e:
+        await ctx.send(f'Error removing role: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_roles=True)
+async def export_role_members(ctx, *role_names):
+    """Exports the members of one or more roles as a CSV attachment."""
+    try:
+        if not role_names:
+            await ctx.send("No role names provided! Example: !export_role_members Admin Moderator")
+            return
+
+        with trace_span("resolve_names"):
+            roles = []
+            for role_name in role_names:
+                role = discord.utils.get(ctx.guild.roles, name=role_name)
+                if role:
+                    roles.append(role)
+                else:
+                    await ctx.send(f'Role not found: {role_name}')
+                    return
+
+        progress = await ctx.send(f'Exporting members of {", ".join(role_names)}...')
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as fp:
+            counts = await write_role_members_csv(ctx.guild, roles, fp)
+            size = fp.tell()
+            fp.seek(0)
+            summary = ", ".join(f"{name}: {count}" for name, count in counts.items())[:1500]
+            if size > ctx.guild.filesize_limit:
+                await progress.edit(content=f'Export is too large to upload ({size} bytes). Members per role: {summary}')
+                return
+            await ctx.send(f'Members per role: {summary}', file=discord.File(fp, filename="role_members.csv"))
+        await progress.delete()
+        print(f"Exported members of roles {', '.join(role_names)}: {summary}")
+    except Exception as e:
+        await ctx.send(f'Error exporting role members: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_channels=True)
+async def add_roles_to_channels(ctx, *args):
+    """Adds role permissions to multiple channels. 
+    Usage: !add_roles_to_channels -r role1 role2 [-ch channel1 channel2]
+    If -ch is omitted, roles will be added to all channels below the command channel."""
+    try:
+        roles = []
+        channel_names = []
+
+        # Parse arguments
+        with trace_span("parse_arguments"):
+            args_list = list(args)
+            flag = None
+
+            dry_run = "--dry-run" in args_list
+
+            for arg in args_list:
+                if arg == "--dry-run":
+                    continue
+                elif arg.startswith("-"):
+                    flag = arg
+                elif flag == "-r":
+                    roles.append(arg)
+                elif flag == "-ch":
+                    channel_names.append(arg)
+
+        if not roles:
+            await ctx.send("Please specify roles (-r). Example: !add_roles_to_channels -r role1 role2 [-ch channel1 channel2]")
+            return
+
+        # Get role objects
+        with trace_span("resolve_names"):
+            role_objects = []
+            for role_name in roles:
+                role = discord.utils.get(ctx.guild.roles, name=role_name)
+                if role:
+                    role_objects.append(role)
+                else:
+                    await ctx.send(f'Role not found: {role_name}')
+                    return
+
+        # Determine target channels
+        with trace_span("resolve_names"):
+            target_channels = []
+            command_channel = ctx.channel
+        
+            # Debug: Print command channel info
+            print(f"Command channel: {command_channel.name} (ID: {command_channel.id}, Position: {command_channel.position})")
+        
+            if channel_names:
+                # User specified channel names - find matching channels that are below the command channel
+            
+                # Get ALL text channels in the server and sort by position
+                all_guild_channels = list(ctx.guild.text_channels)
+                all_guild_channels.sort(key=lambda ch: ch.position)
+            
+                # Debug: Print all channels in the server
+                print(f"\nAll text channels in server (sorted by position):")
+                for i, ch in enumerate(all_guild_channels):
+                    marker = " <- COMMAND CHANNEL" if ch == command_channel else ""
+                    category_name = ch.category.name if ch.category else "No Category"
+                    print(f"  Index {i}: {ch.name} (Category: {category_name}, Position: {ch.position}){marker}")
+            
+                # Find the index of the command channel
+                try:
+                    command_index = all_guild_channels.index(command_channel)
+                    print(f"\nCommand channel index in full server list: {command_index}")
+                    # Get all channels after this index (below in the list)
+                    channels_below = all_guild_channels[command_index + 1:]
+                    print(f"Total channels below: {len(channels_below)}")
+                except ValueError:
+                    channels_below = []
+                    print("Command channel not found in guild channels")
+            
+                print(f"\nAll channels below command channel: {[ch.name for ch in channels_below]}")
+            
+                # Now filter for channels matching the specified names
+                for channel_name in channel_names:
+                    matching_channels = [ch for ch in channels_below if ch.name == channel_name]
+                    target_channels.extend(matching_channels)
+                    print(f"Channels named '{channel_name}' below command channel: {[ch.name for ch in matching_channels]}")
+            
+                if not target_channels:
+                    await ctx.send(f'No channels named {", ".join(channel_names)} found below the command channel.')
+                    return
+                    matching_channels = [ch for ch in channels_below if ch.name == channel_name]
+                    target_channels.extend(matching_channels)
+                    print(f"Channels named '{channel_name}' below command channel: {[ch.name for ch in matching_channels]}")
+            
+                if not target_channels:
+                    await ctx.send(f'No channels named {", ".join(channel_names)} found below the command channel.')
+                    return
+            else:
+                # No channels specified - use all channels below the command channel
+                if command_channel.category:
+                    # In a category - get channels in same category, sort by position, then filter for those below
+                    category_channels = [
+                        ch for ch in command_channel.category.channels 
+                        if isinstance(ch, discord.TextChannel)
+                    ]
+                    # Sort channels by position to get correct order
+                    category_channels.sort(key=lambda ch: ch.position)
+                
+                    # Debug: Print all channels in category with their positions
+                    print(f"Category: {command_channel.category.name}")
+                    for i, ch in enumerate(category_channels):
+                        marker = " <- COMMAND CHANNEL" if ch == command_channel else ""
+                        print(f"  Index {i}: {ch.name} (Position: {ch.position}){marker}")
+                
+                    # Find the index of the command channel
+                    try:
+                        command_index = category_channels.index(command_channel)
+                        print(f"Command channel index: {command_index}")
+                        # Get all channels after this index (below in the list)
+                        target_channels = category_channels[command_index + 1:]
+                        print(f"Target channels (below): {[ch.name for ch in target_channels]}")
+                    except ValueError:
+                        target_channels = []
+                        print("Command channel not found in category channels")
+                else:
+                    # Not in a category - get all channels below this position (that are also not in categories)
+                    guild_channels = [
+                        ch for ch in ctx.guild.text_channels 
+                        if ch.category is None
+                    ]
+                    # Sort channels by position
+                    guild_channels.sort(key=lambda ch: ch.position)
+                
+                    # Debug: Print all channels
+                    print("Channels outside categories:")
+                    for i, ch in enumerate(guild_channels):
+                        marker = " <- COMMAND CHANNEL" if ch == command_channel else ""
+                        print(f"  Index {i}: {ch.name} (Position: {ch.position}){marker}")
+                
+                    # Find the index of the command channel
+                    try:
+                        command_index = guild_channels.index(command_channel)
+                        print(f"Command channel index: {command_index}")
+                        # Get all channels after this index
+                        target_channels = guild_channels[command_index + 1:]
+                        print(f"Target channels (below): {[ch.name for ch in target_channels]}")
+                    except ValueError:
+                        target_channels = []
+                        print("Command channel not found in guild channels")
+            
+                if not target_channels:
+                    await ctx.send("No channels found below the current channel.")
+                    return
+
+        if dry_run:
+            plan = []
+            skipped = []
+            for channel in dict.fromkeys(target_channels):
+                for role in role_objects:
+                    if grants_channel_access(channel, role):
+                        skipped.append(f"{role.name} in #{channel.name}")
+                        continue
+                    route = Route('PUT', '/channels/{channel_id}/permissions/{target}', channel_id=channel.id, target=role.id)
+                    run = functools.partial(channel.set_permissions, role, view_channel=True, send_messages=True)
+                    plan.append(plan_call(route, f"Allow {role.name} in #{channel.name}", run))
+            await report_plan(ctx, "add_roles_to_channels", plan, skipped, ["manage_channels"])
+            return
+
+        # Apply permissions to target channels
+        updated_channels = {}
+        targets = {}
+        for channel in dict.fromkeys(target_channels):
+            for role in role_objects:
+                if not grants_channel_access(channel, role):
+                    targets[(ctx.guild.id, "add_roles_to_channels", channel.id, role.id)] = (channel, role)
+
+        # Claim every overwrite up front; the ones another command is already applying are left to it
+        with claim_in_flight(targets) as (claimed, waiting):
+            for key, (channel, role) in targets.items():
+                if key not in claimed:
+                    continue
+                await channel.set_permissions(role, view_channel=True, send_messages=True)
+                finish_in_flight(claimed, key, True)
+                print(f"Added role {role.name} to channel {channel.name} (ID: {channel.id})")
+                # Only channels where at least one overwrite was actually set are reported
+                updated_channels.setdefault(channel.id, channel.name)
+        total_channels_updated = len(updated_channels)
+
+        if updated_channels:
+            channel_list = ", ".join(updated_channels.values())
+            await ctx.send(f'Roles {", ".join(roles)} added to {total_channels_updated} channel(s): {channel_list}')
+        elif not waiting:
+            await ctx.send(f'Roles {", ".join(roles)} already have access to all {len(dict.fromkeys(target_channels))} target channel(s).')
+        await wait_for_in_flight(ctx, waiting)
+    except Exception as e:
+        await ctx.send(f'Error adding roles to channels: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_channels=True)
+async def delete_roles_from_channels(ctx, *args):
+    """Removes role permissions from multiple channels. Usage: !delete_roles_from_channels -r role1 role2 -ch channel1 channel2
+    Use --all instead of -ch to remove the roles from every channel where they have an overwrite."""
+    try:
+        roles = []
+        channel_names = []
+        all_channels = False
+
+        # Parse arguments
+        with trace_span("parse_arguments"):
+            args_list = list(args)
+            flag = None
+
+            for arg in args_list:
+                if arg == "--all":
+                    all_channels = True
+                elif arg.startswith("-"):
+                    flag = arg
+                elif flag == "-r":
+                    roles.append(arg)
+                elif flag == "-ch":
+                    channel_names.append(arg)
+
+        if not roles or not (channel_names or all_channels):
+            await ctx.send("Please specify roles (-r) and channels (-ch) or --all. Example: !delete_roles_from_channels -r role1 -ch announcement discussion")
+            return
+
+        # Get role objects
+        with trace_span("resolve_names"):
+            role_objects = []
+            for role_name in roles:
+                role = discord.utils.get(ctx.guild.roles, name=role_name)
+                if role:
+                    role_objects.append(role)
+                else:
+                    await ctx.send(f'Role not found: {role_name}')
+                    return
+
+        if all_channels:
+            # Only the channels that actually hold an overwrite for each role are touched
+            total_channels_updated = 0
+            for role in role_objects:
+                with trace_span("resolve_names"):
+                    channels = channels_with_overwrites(ctx.guild, role)
+                for channel in channels:
+                    await channel.set_permissions(role, overwrite=None)
+                    total_channels_updated += 1
+                    print(f"Removed role {role.name} from channel {channel.name} (ID: {channel.id})")
+            await ctx.send(f'Roles {", ".join(roles)} removed from all channels - Total: {total_channels_updated} overwrite(s) removed')
+            return
+
+        # Process each channel (handle multiple channels with same name)
+        updated_channel_names = []
+        not_found_channels = []
+        total_channels_updated = 0
+        
+        for channel_name in channel_names:
+            # Find all channels with this name
+            with trace_span("resolve_names"):
+                matching_channels = [ch for ch in ctx.guild.channels if ch.name == channel_name]
+            
+            if matching_channels:
+                for channel in matching_channels:
+                    for role in role_objects:
+                        await channel.set_permissions(role, overwrite=None)
+                        print(f"Removed role {role.name} from channel {channel_name} (ID: {channel.id})")
+                    total_channels_updated += 1
+                updated_channel_names.append(f"{channel_name} ({len(matching_channels)} channel(s))")
+            else:
+                not_found_channels.append(channel_name)
+
+        if updated_channel_names:
+            await ctx.send(f'Roles {", ".join(roles)} removed from: {", ".join(updated_channel_names)} - Total: {total_channels_updated} channel(s) updated')
+        if not_found_channels:
+            await ctx.send(f'Channels not found: {", ".join(not_found_channels)}')
+    except Exception as e:
+        await ctx.send(f'Error removing roles from channels: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_channels=True)
+async def audit_overwrites(ctx, *role_names):
+    """Lists every channel where the given roles have permission overwrites. Usage: !audit_overwrites role1 role2"""
+    try:
+        if not role_names:
+            await ctx.send("No role names provided! Example: !audit_overwrites Student")
+            return
+
+        response_parts = []
+        for role_name in role_names:
+            with trace_span("resolve_names"):
+                role = discord.utils.get(ctx.guild.roles, name=role_name)
+            if not role:
+                response_parts.append(f'Role not found: {role_name}')
+                continue
+
+            channels = sorted(channels_with_overwrites(ctx.guild, role), key=lambda ch: ch.position)
+            lines = []
+            for channel in channels:
+                allow, deny = channel.overwrites_for(role).pair()
+                allowed = ", ".join(name for name, value in allow if value) or "-"
+                denied = ", ".join(name for name, value in deny if value) or "-"
+                lines.append(f"#{channel.name} (ID: {channel.id}) allow: {allowed}; deny: {denied}")
+            response_parts.append(f'Role "{role_name}" has overwrites in {len(channels)} channel(s):\n' + "\n".join(lines))
+
+        # Send response in chunks if too long
+        message = ""
+        for line in "\n".join(response_parts).split("\n"):
+            if len(message) + len(line) + 1 > 2000:
+                await ctx.send(message)
+                message = ""
+            message += line[:1999] + "\n"
+        if message:
+            await ctx.send(message)
+    except Exception as e:
+        await ctx.send(f'Error auditing overwrites: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_channels=True)
+async def remove_messaging_permissions(ctx, *args):
+    """Makes specified channels read-only for a given role (removes send/thread permissions, keeps view permission).
+    Only modifies channels where the role already has explicit permissions.
+    Supports duplicate channel names - will update all channels with the same name.
+    Usage: !remove_messaging_permissions -r role_name -ch channel1 channel2
+    Example: !remove_messaging_permissions -r Student -ch announcement general-info"""
+    try:
+        role_name = None
+        channel_names = []
+
+        # Parse arguments
+        with trace_span("parse_arguments"):
+            args_list = list(args)
+            flag = None
+
+            for arg in args_list:
+                if arg.startswith("-"):
+                    flag = arg
+                elif flag == "-r":
+                    role_name = arg
+                    flag = None  # Only take first role name
+                elif flag == "-ch":
+                    channel_names.append(arg)
+
+        if not role_name or not channel_names:
+            await ctx.send("Please specify a role (-r) and channels (-ch). Example: !remove_messaging_permissions -r Student -ch announcement")
+            return
+
+        # Get role object
+        with trace_span("resolve_names"):
+            role = discord.utils.get(ctx.guild.roles, name=role_name)
+        if not role:
+            await ctx.send(f'Role not found: {role_name}')
+            return
+
+        # Process each channel name (handle multiple channels with same name)
+        updated_channels = []
+        skipped_channels = []
+        not_found_channels = set()
+        total_channels_updated = 0
+        
+        for channel_name in channel_names:
+            # Find all text channels with this name
+            with trace_span("resolve_names"):
+                matching_channels = [ch for ch in ctx.guild.text_channels if ch.name == channel_name]
+            
+            if not matching_channels:
+                not_found_channels.add(channel_name)
+                continue
+            
+            for channel in matching_channels:
+                # Check if role has explicit permissions in this channel
+                role_overwrite = channel.overwrites_for(role)
+                
+                # Check if the role has any explicit permissions set (not default/None)
+                has_explicit_perms = any([
+                    role_overwrite.view_channel is not None,
+                    role_overwrite.send_messages is not None,
+                    role_overwrite.create_public_threads is not None,
+                    role_overwrite.create_private_threads is not None,
+                    role_overwrite.send_messages_in_threads is not None
+                ])
+                
+                if has_explicit_perms:
+                    # Role has explicit permissions, keep view_channel but deny messaging
+                    # Get current overwrites to preserve view_channel setting
+                    current_overwrites = channel.overwrites_for(role)
+                    
+                    await channel.set_permissions(
+                        role,
+                        view_channel=current_overwrites.view_channel if current_overwrites.view_channel is not None else True,
+                        send_messages=False,
+                        create_public_threads=False,
+                        create_private_threads=False,
+                        send_messages_in_threads=False
+                    )
+                    updated_channels.append(f"{channel.name} (ID: {channel.id})")
+                    total_channels_updated += 1
+                    print(f"Made channel {channel.name} (ID: {channel.id}) read-only for role {role.name}")
+                else:
+                    # Role doesn't have explicit permissions, skip it
+                    skipped_channels.append(f"{channel.name} (ID: {channel.id})")
+                    print(f"Skipped channel {channel.name} (ID: {channel.id}) - role {role.name} has no explicit permissions")
+
+        # Send feedback
+        response_parts = []
+        
+        if updated_channels:
+            response_parts.append(f'Made {total_channels_updated} channel(s) read-only for role "{role_name}": {", ".join(updated_channels)}')
+        
+        if skipped_channels:
+            response_parts.append(f'Skipped {len(skipped_channels)} channel(s) where role has no explicit permissions: {", ".join(skipped_channels)}')
+        
+        if not_found_channels:
+            response_parts.append(f'Channels not found: {", ".join(not_found_channels)}')
+        
+        if not response_parts:
+            await ctx.send(f'No channels were updated.')
+        else:
+            # Send response in chunks if too long
+            full_response = '\n'.join(response_parts)
+            if len(full_response) > 2000:
+                for part in response_parts:
+                    await ctx.send(part)
+            else:
+                await ctx.send(full_response)
+                
+    except Exception as e:
+        await ctx.send(f'Error making channels read-only: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+@commands.has_permissions(manage_channels=True)
+async def create_categories_with_channels(ctx, *args):
+    """Creates multiple categories with specific channels accessible only to specific roles."""
+    try:
+        categories = []
+        roles = []
+        channels = []
+
+        # Use a more robust argument parsing method
+        with trace_span("parse_arguments"):
+            args_list = list(args)
+            flag = None
+
+            dry_run = "--dry-run" in args_list
+
+            for arg in args_list:
+                if arg == "--dry-run":
+                    continue
+                elif arg.startswith("-"):
+                    flag = arg
+                elif flag == "-m":
+                    categories.append(arg)
+                elif flag == "-r":
+                    roles.append(arg)
+                elif flag == "-ch":
+                    channels.append(arg)
+
+        if not categories or not roles or not channels:
+            await ctx.send("Please specify categories (-m), roles (-r), and channels (-ch). Example: !create_categories_with_channels -m Category1 Category2 -r Role1 Role2 -ch Channel1 Channel2")
+            return
+
+        if dry_run:
+            overwrites = {
+                ctx.guild.default_role: discord.PermissionOverwrite(view_channel=False)
+            }
+            with trace_span("resolve_names"):
+                for role_name in roles:
+                    role = discord.utils.get(ctx.guild.roles, name=role_name)
+                    if not role:
+                        await ctx.send(f'Role not found: {role_name}')
+                        return
+                    overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+
+            # Channel creation needs the category created by an earlier step of the plan
+            created = {}
+
+            async def create_category(category_name):
+                created[category_name] = await ctx.guild.create_category(category_name, overwrites=overwrites)
+
+            async def create_channel(category_name, channel_name):
+                category = created.get(category_name)
+                if category is None:
+                    raise PlanStepFailed(f"category {category_name} was not created")
+                await category.create_text_channel(channel_name)
+
+            # Creation is never a no-op, so nothing is skipped
+            plan = []
+            route = Route('POST', '/guilds/{guild_id}/channels', guild_id=ctx.guild.id)
+            for category_name in categories:
+                plan.append(plan_call(route, f"Create category {category_name}", functools.partial(create_category, category_name)))
+                for channel_name in channels:
+                    plan.append(plan_call(route, f"Create #{channel_name} in {category_name}", functools.partial(create_channel, category_name, channel_name)))
+            await report_plan(ctx, "create_categories_with_channels", plan, [], ["manage_channels"])
+            return
+
+        for category_name in categories:
+            # Create overwrites for the specified roles
+            overwrites = {
+                ctx.guild.default_role: discord.PermissionOverwrite(view_channel=False)
+            }
+            with trace_span("resolve_names"):
+                for role_name in roles:
+                    role = discord.utils.get(ctx.guild.roles, name=role_name)
+                    if role:
+                        overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+                    else:
+                        await ctx.send(f'Role not found: {role_name}')
+                        return
+
+            # Create the category
+            category = await ctx.guild.create_category(category_name, overwrites=overwrites)
+            print(f"Created category: {category_name}")
+
+            # Create channels within the category
+            created_channels = []
+            for channel_name in channels:
+                channel = await category.create_text_channel(channel_name)
+                created_channels.append(channel.name)
+                print(f"Created channel: {channel_name} in category {category_name}")
+
+            await ctx.send(f'Category "{category_name}" with channels "{", ".join(created_channels)}" created for roles "{", ".join(roles)}".')
+    except Exception as e:
+        await ctx.send(f'Error creating categories or channels: {e}')
+        print(f"Error: {e}")
+
+@commands.command()
+async def confirm(ctx):
+    """Runs the plan from your last --dry-run without resolving names again."""
+    try:
+        pending = pending_plans.pop((ctx.guild.id, ctx.author.id), None)
+        if not pending or time.monotonic() - pending["created"] > PLAN_TTL:
+            await ctx.send("No pending dry run to confirm. Run the command again with --dry-run first.")
+            return
+        # Permissions may have been removed since the dry run
+        permissions = ctx.channel.permissions_for(ctx.author)
+        missing = [name for name in pending["permissions"] if not getattr(permissions, name)]
+        if missing:
+            await ctx.send(f'You no longer have the permissions {pending["command"]} requires: {", ".join(missing)}. The plan was discarded.')
+            return
+
+        progress = await ctx.send(f'Running {len(pending["plan"])} planned call(s) for {pending["command"]}...')
+        done = 0
+        failed = []
+        for call in pending["plan"]:
+            try:
+                await call["run"]()
+                done += 1
+                print(f"Confirmed plan step: {call['description']}")
+            except (discord.HTTPException, PlanStepFailed) as e:
+                failed.append(call["description"])
+                print(f"Error running plan step {call['description']}: {e}")
+
+        message = f'{pending["command"]}: {done} of {len(pending["plan"])} planned call(s) completed.'
+        if failed:
+            message += f' Failed: {", ".join(failed)}'
+        await progress.edit(content=message[:2000])
+    except Exception as e:
+        await ctx.send(f'Error running plan: {e}')
+        print(f"Error: {e}")
+
+async def setup(client):
+    global bot
+    bot = client
+    client.add_listener(build_overwrite_index, 'on_ready')
+    client.add_listener(index_joined_guild, 'on_guild_join')
+    client.add_listener(unindex_removed_guild, 'on_guild_remove')
+    client.add_listener(index_created_channel, 'on_guild_channel_create')
+    client.add_listener(reindex_updated_channel, 'on_guild_channel_update')
+    client.add_listener(unindex_deleted_channel, 'on_guild_channel_delete')
+    client.add_listener(unindex_deleted_role, 'on_guild_role_delete')
+    register_command_set(COMMAND_SET, globals())
+
+async def teardown(client):
+    # Listeners added by this module are removed by the library when it is unloaded
+    unregister_command_set(COMMAND_SET)
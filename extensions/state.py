@@ -0,0 +1,14 @@
+# State used by the command extensions. It lives outside the extension modules so that
+# !reload swaps the command code but keeps running operations, indexes and pending plans.
+
+# In-flight REST operations keyed by normalised target, e.g. (guild_id, "add_role", member_id, role_id).
+# A command that finds its target here waits for the running operation instead of sending the call again.
+in_flight_operations = {}
+
+# Inverted index of role ID -> IDs of channels that hold a permission overwrite for that role.
+# Built once per guild and kept current from channel and role events, so guild-wide overwrite
+# lookups only touch the affected channels.
+role_overwrite_index = {}
+
+# Plans waiting for !confirm, keyed by (guild ID, author ID)
+pending_plans = {}
@@ -0,0 +1,215 @@
+import sys
+from array import array
+from tracing import trace_span
+
+# Members fetched per REST page when filling the cache
+POPULATE_PAGE_SIZE = 1000
+
+
+class CompactMember:
+    """The member fields the bot actually uses: ID, username, nickname and role IDs.
+    Names are interned and role IDs are packed into an array('Q'), so a record costs a
+    fraction of a full discord.Member plus its discord.User."""
+
+    __slots__ = ("id", "name", "nick", "role_ids")
+
+    def __init__(self, id, name, nick, role_ids):
+        self.id = id
+        self.name = sys.intern(name)
+        self.nick = sys.intern(nick) if nick else None
+        self.role_ids = array("Q", role_ids)
+
+    @classmethod
+    def from_data(cls, data):
+        """Builds a record from a raw member payload (REST member list or gateway event)."""
+        user = data["user"]
+        return cls(int(user["id"]), user["username"], data.get("nick"), map(int, data.get("roles", ())))
+
+    @classmethod
+    def from_member(cls, member):
+        return cls(member.id, member.name, member.nick, (role.id for role in member.roles if not role.is_default()))
+
+    def has_role(self, role_id):
+        return role_id in self.role_ids
+
+    def add_role_id(self, role_id):
+        if role_id not in self.role_ids:
+            self.role_ids.append(role_id)
+
+    def remove_role_id(self, role_id):
+        if role_id in self.role_ids:
+            self.role_ids.remove(role_id)
+
+    def __repr__(self):
+        return f"<CompactMember id={self.id} name={self.name!r} roles={len(self.role_ids)}>"
+
+
+class CompactMemberCache:
+    """Per-guild store of CompactMember records, indexed by member ID and by username."""
+
+    def __init__(self):
+        self.members = {}
+        self.names = {}
+
+    def add(self, guild_id, record):
+        members = self.members.setdefault(guild_id, {})
+        names = self.names.setdefault(guild_id, {})
+        old = members.get(record.id)
+        if old is not None and names.get(old.name) is old:
+            del names[old.name]
+        members[record.id] = record
+        names.setdefault(record.name, record)
+
+    def add_data(self, guild_id, data):
+        self.add(guild_id, CompactMember.from_data(data))
+
+    def update_data(self, guild_id, data):
+        """Applies a GUILD_MEMBER_UPDATE payload. Unknown members are added."""
+        record = self.get(guild_id, int(data["user"]["id"]))
+        if record is None or record.name != data["user"]["username"]:
+            self.add_data(guild_id, data)
+            return
+        record.nick = sys.intern(data["nick"]) if data.get("nick") else None
+        record.role_ids = array("Q", map(int, data.get("roles", ())))
+
+    def remove(self, guild_id, member_id):
+        record = self.members.get(guild_id, {}).pop(member_id, None)
+        if record is not None and self.names[guild_id].get(record.name) is record:
+            del self.names[guild_id][record.name]
+
+    def remove_guild(self, guild_id):
+        self.members.pop(guild_id, None)
+        self.names.pop(guild_id, None)
+
+    def shrink(self, guild_id):
+        """Copies a guild's dictionaries after many removals, releasing the slots they keep."""
+        if guild_id in self.members:
+            self.members[guild_id] = dict(self.members[guild_id])
+            self.names[guild_id] = dict(self.names[guild_id])
+
+    def get(self, guild_id, member_id):
+        return self.members.get(guild_id, {}).get(member_id)
+
+    def get_named(self, guild_id, name):
+        return self.names.get(guild_id, {}).get(name)
+
+    def resolve(self, guild_id, usernames):
+        """Resolves usernames to records with one dictionary lookup each."""
+        names = self.names.get(guild_id, {})
+        resolved = {}
+        for username in usernames:
+            record = names.get(username)
+            if record is not None:
+                resolved[username] = record
+        return resolved
+
+    def count(self, guild_id=None):
+        if guild_id is not None:
+            return len(self.members.get(guild_id, {}))
+        return sum(len(members) for members in self.members.values())
+
+
+async def populate_guild(bot, cache, guild):
+    """Fills the cache for a guild from the paginated REST member list, without building Member objects."""
+    cache.remove_guild(guild.id)
+    after = None
+    while True:
+        page = await bot.http.get_members(guild.id, limit=POPULATE_PAGE_SIZE, after=after)
+        for data in page:
+            cache.add_data(guild.id, data)
+        if len(page) < POPULATE_PAGE_SIZE:
+            break
+        after = page[-1]["user"]["id"]
+    print(f"Cached {cache.count(guild.id)} compact member record(s) for {guild.name}")
+
+
+def install_compact_member_cache(bot, cache):
+    """Keeps the compact cache in sync with the gateway.
+    The bot must be created with member_cache_flags=MemberCacheFlags.none(). The library then does not
+    dispatch member_update, so GUILD_MEMBER_UPDATE payloads are read straight from the gateway parser.
+    The cache is also stored as bot.compact_member_cache. guild.members is empty in this mode, so
+    commands must use resolve_members and add_member_roles/remove_member_roles below."""
+    bot.compact_member_cache = cache
+    parsers = bot._connection.parsers
+    parse_member_update = parsers["GUILD_MEMBER_UPDATE"]
+
+    def parse_guild_member_update(data):
+        cache.update_data(int(data["guild_id"]), data)
+        parse_member_update(data)
+
+    parsers["GUILD_MEMBER_UPDATE"] = parse_guild_member_update
+
+    @bot.listen("on_ready")
+    async def populate_compact_member_cache():
+        for guild in bot.guilds:
+            await populate_guild(bot, cache, guild)
+
+    @bot.listen("on_guild_join")
+    async def populate_joined_guild(guild):
+        await populate_guild(bot, cache, guild)
+
+    @bot.listen("on_guild_remove")
+    async def drop_removed_guild(guild):
+        cache.remove_guild(guild.id)
+
+    @bot.listen("on_member_join")
+    async def cache_joined_member(member):
+        cache.add(member.guild.id, CompactMember.from_member(member))
+
+    @bot.listen("on_raw_member_remove")
+    async def uncache_removed_member(payload):
+        cache.remove(payload.guild_id, payload.user.id)
+
+
+# Member lookups for the commands. With COMPACT_MEMBER_CACHE=1 the library member cache is off for the
+# whole process and guild.members is empty, so every command set must resolve and update members
+# through these functions instead of reading guild.members or calling Member methods directly.
+
+async def resolve_members(bot, guild, usernames):
+    """Resolves a batch of usernames to members with a single pass over the member cache in use.
+    With the compact cache enabled the results are CompactMember records instead of Members.
+    Members evicted by the cache budgets (bot.cache_budgets) are looked up again, all at once."""
+    compact_cache = getattr(bot, "compact_member_cache", None)
+    cache_budgets = getattr(bot, "cache_budgets", None)
+    wanted = set(usernames)
+    resolved = {}
+    with trace_span("resolve_names", count=len(wanted)):
+        if compact_cache is not None:
+            resolved = compact_cache.resolve(guild.id, wanted)
+        else:
+            for member in guild.members:
+                if member.name in wanted and member.name not in resolved:
+                    resolved[member.name] = member
+                    if len(resolved) == len(wanted):
+                        break
+        if cache_budgets is not None:
+            resolved.update(await cache_budgets.find_members_named(guild, wanted - resolved.keys()))
+            for member in resolved.values():
+                cache_budgets.touch(guild.id, member.id)
+    return resolved
+
+
+def member_has_role(member, role):
+    if isinstance(member, CompactMember):
+        return member.has_role(role.id)
+    return role in member.roles
+
+
+async def add_member_roles(bot, guild, member, roles):
+    """Adds roles to a Member, or to a CompactMember record with one request per role."""
+    if isinstance(member, CompactMember):
+        for role in roles:
+            await bot.http.add_role(guild.id, member.id, role.id)
+            member.add_role_id(role.id)
+    else:
+        await member.add_roles(*roles)
+
+
+async def remove_member_roles(bot, guild, member, roles):
+    """Removes roles from a Member, or from a CompactMember record with one request per role."""
+    if isinstance(member, CompactMember):
+        for role in roles:
+            await bot.http.remove_role(guild.id, member.id, role.id)
+            member.remove_role_id(role.id)
+    else:
+        await member.remove_roles(*roles)
@@ -0,0 +1,384 @@
+import asyncio
+import itertools
+import linecache
+import math
+import os
+import sys
+import tracemalloc
+import types
+import weakref
+from array import array
+from collections import OrderedDict, deque
+
+import discord
+from discord.state import ConnectionState
+
+# Objects measured per cache; the cache size is extrapolated from their average
+SAMPLE_SIZE = 200
+# tracemalloc snapshots kept for !memory diff (oldest dropped first)
+MAX_SNAPSHOTS = 5
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '1'))
+
+# Only these caches can be shrunk at runtime. The library needs guilds, roles and channels to work.
+BUDGETED_CACHES = ("members", "messages")
+# Budgets are enforced down to this fraction, so eviction does not run again right away
+EVICT_TO = 0.9
+# Members used by commands recently are evicted last
+RECENT_MEMBERS_MAX = 10000
+# Evicted members a command needs are looked up again, either with concurrent gateway queries (one per
+# name, at most this many) or with one pass over the REST member list, whichever takes fewer requests.
+# Gateway requests are limited to about 120 a minute, so they are only used for a few names in large guilds.
+MEMBER_QUERY_LIMIT = 10
+MEMBER_PAGE_SIZE = 1000
+SIZE_UNITS = {"b": 1, "kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}
+
+# Shared objects that a cached object points to but does not own
+SHARED_TYPES = (
+    discord.Guild, discord.abc.GuildChannel, discord.Thread, discord.Role, discord.Member,
+    discord.Client, discord.http.HTTPClient, ConnectionState, asyncio.AbstractEventLoop,
+    type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+    types.CodeType, weakref.ref,
+)
+# Messages also point at their author, who is counted with the members
+MESSAGE_SHARED_TYPES = SHARED_TYPES + (discord.User, discord.ClientUser)
+
+
+def parse_size(text):
+    """Parses sizes like 512KB, 200MB or 1.5GB into bytes."""
+    number = text.strip().lower()
+    for unit in ("gb", "mb", "kb", "b"):
+        if number.endswith(unit):
+            return int(float(number[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(number)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+
+def deep_sizeof(root, shared_types=SHARED_TYPES):
+    """Bytes owned by an object: the object, its attributes and containers, stopping at shared objects."""
+    seen = set()
+    stack = [root]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or (obj is not root and isinstance(obj, shared_types)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, int, float, bool, array)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get("__slots__", ()):
+                    value = getattr(obj, name, None)
+                    if value is not None:
+                        stack.append(value)
+    return size
+
+
+def estimate_cache(objects, count, container_bytes=0, shared_types=SHARED_TYPES):
+    """Estimates a cache's size from a sample of its objects. Returns (count, bytes)."""
+    sample = list(itertools.islice(objects, SAMPLE_SIZE))
+    if not sample:
+        return count, container_bytes
+    average = sum(deep_sizeof(obj, shared_types) for obj in sample) / len(sample)
+    return count, int(average * count) + container_bytes
+
+
+def cache_breakdown(bot, extra_caches=None):
+    """Returns {cache name: (object count, estimated bytes)} for the library caches and any extra caches."""
+    state = bot._connection
+    guilds = list(state._guilds.values())
+    member_dicts = [guild._members for guild in guilds]
+    role_dicts = [guild._roles for guild in guilds]
+    channel_dicts = [guild._channels for guild in guilds] + [guild._threads for guild in guilds]
+
+    # The guild objects themselves, without the member, role and channel caches they hold
+    guild_containers = {id(container) for container in member_dicts + role_dicts + channel_dicts}
+    guild_bytes = sys.getsizeof(state._guilds)
+    for guild in guilds:
+        guild_bytes += sys.getsizeof(guild)
+        for name in type(guild).__slots__:
+            value = getattr(guild, name, None)
+            if value is not None and id(value) not in guild_containers and not isinstance(value, SHARED_TYPES):
+                guild_bytes += deep_sizeof(value)
+
+    breakdown = {
+        "guilds": (len(guilds), guild_bytes),
+        "members": estimate_cache(
+            itertools.chain.from_iterable(members.values() for members in member_dicts),
+            sum(map(len, member_dicts)),
+            sum(map(sys.getsizeof, member_dicts)),
+        ),
+        "roles": estimate_cache(
+            itertools.chain.from_iterable(roles.values() for roles in role_dicts),
+            sum(map(len, role_dicts)),
+            sum(map(sys.getsizeof, role_dicts)),
+        ),
+        "channels": estimate_cache(
+            itertools.chain.from_iterable(channels.values() for channels in channel_dicts),
+            sum(map(len, channel_dicts)),
+            sum(map(sys.getsizeof, channel_dicts)),
+        ),
+    }
+    messages = state._messages if state._messages is not None else ()
+    breakdown["messages"] = estimate_cache(reversed(messages), len(messages), sys.getsizeof(messages), MESSAGE_SHARED_TYPES)
+
+    compact_cache = getattr(bot, "compact_member_cache", None)
+    if compact_cache is not None:
+        records = itertools.chain.from_iterable(members.values() for members in compact_cache.members.values())
+        containers = sum(map(sys.getsizeof, compact_cache.members.values())) + sum(map(sys.getsizeof, compact_cache.names.values()))
+        breakdown["compact members"] = estimate_cache(records, compact_cache.count(), containers)
+
+    for name, cache in (extra_caches or {}).items():
+        breakdown[name] = (len(cache), deep_sizeof(cache))
+    return breakdown
+
+
+def rss_bytes():
+    """Resident set size of the process, from /proc (Linux only)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class SnapshotStore:
+    """Named tracemalloc snapshots. Tracing starts with the first snapshot, since it slows every allocation."""
+
+    def __init__(self):
+        self.snapshots = OrderedDict()
+        self.counter = itertools.count(1)
+
+    async def take(self, label=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        label = label or f"snap{next(self.counter)}"
+        # Taking and filtering a snapshot of a large heap takes a while; keep it off the event loop
+        snapshot = await asyncio.to_thread(self.filtered_snapshot)
+        self.snapshots.pop(label, None)
+        self.snapshots[label] = snapshot
+        while len(self.snapshots) > MAX_SNAPSHOTS:
+            self.snapshots.popitem(last=False)
+        return label, snapshot
+
+    @staticmethod
+    def filtered_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    async def diff(self, old_label, new_label):
+        old = self.snapshots[old_label]
+        new = self.snapshots[new_label]
+        return await asyncio.to_thread(new.compare_to, old, "lineno")
+
+    def stop(self):
+        tracemalloc.stop()
+        self.snapshots.clear()
+
+
+def format_statistics(statistics, limit):
+    """Formats tracemalloc statistics (or differences) as one line per allocation site."""
+    lines = []
+    for stat in statistics[:limit]:
+        frame = stat.traceback[0]
+        location = f"{os.path.basename(frame.filename)}:{frame.lineno}"
+        if isinstance(stat, tracemalloc.StatisticDiff):
+            lines.append(f"{location:<32} {format_size(stat.size_diff):>10} ({stat.count_diff:+} blocks), now {format_size(stat.size)}")
+        else:
+            lines.append(f"{location:<32} {format_size(stat.size):>10} ({stat.count} blocks)")
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        if source:
+            lines.append(f"    {source[:80]}")
+    return lines
+
+
+class CacheBudgets:
+    """Per-cache memory budgets. enforce() evicts members and shrinks the message cache to fit.
+    Evicted members are looked up again when a command needs them (see find_members_named)."""
+
+    def __init__(self, budgets=None):
+        self.budgets = dict(budgets or {})
+        self.evicted_guilds = set()
+        self.recent_members = OrderedDict()
+        self.evicted = 0
+        # max_messages before a messages budget first lowered it, restored when that budget is removed or raised
+        self.original_max_messages = None
+        self.restore_messages = False
+
+    @classmethod
+    def from_config(cls, text):
+        """Parses "members=256MB,messages=8MB"."""
+        budgets = {}
+        for item in filter(None, (part.strip() for part in text.split(","))):
+            name, _, size = item.partition("=")
+            name = name.strip()
+            if name not in BUDGETED_CACHES:
+                raise ValueError(f"no budget possible for {name!r}; budgeted caches: {', '.join(BUDGETED_CACHES)}")
+            budgets[name] = parse_size(size)
+        return cls(budgets)
+
+    def set_budget(self, name, size):
+        if name not in BUDGETED_CACHES:
+            raise ValueError(f"no budget possible for {name!r}; budgeted caches: {', '.join(BUDGETED_CACHES)}")
+        old_size = self.budgets.get(name)
+        if size is None:
+            self.budgets.pop(name, None)
+        else:
+            self.budgets[name] = size
+        if name == "messages" and old_size is not None and (size is None or size > old_size):
+            self.restore_messages = True
+
+    def restore_message_cache(self, bot):
+        """Gives the message cache its original limit back after its budget was removed or raised.
+        enforce() shrinks it again if it is still over the new budget."""
+        if not self.restore_messages:
+            return
+        self.restore_messages = False
+        if self.original_max_messages is None:
+            return
+        state = bot._connection
+        state.max_messages = self.original_max_messages
+        state._messages = deque(state._messages, maxlen=self.original_max_messages)
+        self.original_max_messages = None
+
+    def touch(self, guild_id, member_id):
+        """Records that a command used a member, so it is evicted last."""
+        key = (guild_id, member_id)
+        self.recent_members.pop(key, None)
+        self.recent_members[key] = None
+        if len(self.recent_members) > RECENT_MEMBERS_MAX:
+            self.recent_members.popitem(last=False)
+
+    def enforce(self, bot, breakdown=None):
+        """Evicts from every cache over its budget. Returns {cache name: objects evicted}."""
+        self.restore_message_cache(bot)
+        if not self.budgets:
+            return {}
+        breakdown = breakdown or cache_breakdown(bot)
+        evicted = {}
+        if "members" in self.budgets:
+            name = "compact members" if "compact members" in breakdown else "members"
+            count, size = breakdown[name]
+            if count and size > self.budgets["members"]:
+                keep = int(count * self.budgets["members"] * EVICT_TO / size)
+                evicted["members"] = self.evict_members(bot, count - keep)
+        if "messages" in self.budgets:
+            count, size = breakdown["messages"]
+            state = bot._connection
+            if count and size > self.budgets["messages"]:
+                keep = max(int(count * self.budgets["messages"] * EVICT_TO / size), 1)
+                evicted["messages"] = count - keep
+                # New messages keep replacing the oldest ones within the smaller limit
+                if self.original_max_messages is None:
+                    self.original_max_messages = state.max_messages
+                state.max_messages = keep
+                state._messages = deque(itertools.islice(reversed(state._messages), keep), maxlen=keep)
+                state._messages.reverse()
+        self.evicted += sum(evicted.values())
+        return evicted
+
+    def evict_members(self, bot, target):
+        """Removes about `target` members, largest guilds first, least recently used first."""
+        compact_cache = getattr(bot, "compact_member_cache", None)
+        guilds = sorted(bot.guilds, key=lambda guild: guild.member_count or 0, reverse=True)
+        removed = 0
+        for recent_pass in (False, True):
+            for guild in guilds:
+                if removed >= target:
+                    break
+                if compact_cache is not None:
+                    member_ids = list(compact_cache.members.get(guild.id, {}))
+                else:
+                    member_ids = list(guild._members)
+                for member_id in member_ids:
+                    if removed >= target:
+                        break
+                    if member_id in (bot.user.id, guild.owner_id):
+                        continue
+                    if not recent_pass and (guild.id, member_id) in self.recent_members:
+                        continue
+                    if compact_cache is not None:
+                        compact_cache.remove(guild.id, member_id)
+                    else:
+                        member = guild._members.get(member_id)
+                        if member is None:
+                            continue
+                        guild._remove_member(member)
+                    self.evicted_guilds.add(guild.id)
+                    removed += 1
+        # Dictionaries keep their size after deletes; copy them so the freed slots are released too
+        for guild in guilds:
+            if guild.id in self.evicted_guilds:
+                if compact_cache is not None:
+                    compact_cache.shrink(guild.id)
+                else:
+                    guild._members = dict(guild._members)
+        return removed
+
+    def reset_evictions(self, guild_id=None):
+        """Forgets evictions once a guild's member cache is filled again (or the guild is gone)."""
+        if guild_id is None:
+            self.evicted_guilds.clear()
+        else:
+            self.evicted_guilds.discard(guild_id)
+
+    async def find_members_named(self, guild, usernames):
+        """Finds members evicted from the cache, for all names a command could not resolve at once.
+        Returns {username: Member}, which is empty for guilds with no evictions."""
+        wanted = set(usernames)
+        if guild.id not in self.evicted_guilds or not wanted:
+            return {}
+        pages = math.ceil((guild.member_count or 0) / MEMBER_PAGE_SIZE)
+        if len(wanted) <= MEMBER_QUERY_LIMIT and len(wanted) < pages:
+            # cache=False so that the lookups do not grow the cache again
+            results = await asyncio.gather(*(guild.query_members(query=username, limit=100, cache=False) for username in wanted))
+            members = itertools.chain.from_iterable(results)
+        else:
+            members = await self.page_members_named(guild, wanted)
+        found = {}
+        for member in members:
+            if member.name in wanted and member.name not in found:
+                found[member.name] = member
+                self.touch(guild.id, member.id)
+        return found
+
+    @staticmethod
+    async def page_members_named(guild, wanted):
+        """Pages through the REST member list once, building Members only for the wanted names."""
+        state = guild._state
+        remaining = set(wanted)
+        members = []
+        after = None
+        while remaining:
+            page = await state.http.get_members(guild.id, limit=MEMBER_PAGE_SIZE, after=after)
+            for data in page:
+                if data["user"]["username"] in remaining:
+                    remaining.discard(data["user"]["username"])
+                    members.append(discord.Member(data=data, guild=guild, state=state))
+            if len(page) < MEMBER_PAGE_SIZE:
+                break
+            after = page[-1]["user"]["id"]
+        return members
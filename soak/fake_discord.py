@@ -0,0 +1,538 @@
+"""A local stand-in for the Discord REST API and gateway, used by the soak harness.
+
+It keeps guilds, roles, channels and members in memory, answers the REST routes the bot
+uses, applies per-bucket rate limits (with real 429 responses) and pushes the matching
+gateway events to each connected bot. Each bot token owns its own set of guilds.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from urllib.parse import unquote
+
+from aiohttp import WSMsgType, web
+
+API_PREFIX = "/api/v10"
+SNOWFLAKES = itertools.count(1_100_000_000_000_000_000)
+
+# Channels and temporary roles created by commands are cleaned up past these counts,
+# like an admin tidying up, so a long soak does not grow the guilds without bound.
+MAX_CREATED_CHANNELS = 60
+MAX_CREATED_ROLES = 40
+
+# The soak harness tags each bot request with the command message it answers, as the audit log reason
+# (the only header the library lets a caller set). Replies are then kept per command message.
+COMMAND_HEADER = "X-Audit-Log-Reason"
+COMMAND_TAG = "soak-command:"
+
+CHANNEL_TEXT = 0
+CHANNEL_VOICE = 2
+CHANNEL_CATEGORY = 4
+ADMINISTRATOR = 8
+
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes bodies whose Content-Type is exactly application/json (no charset)
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers, content_type="application/json")
+
+
+def not_found(message, code):
+    return web.HTTPNotFound(body=json.dumps({"message": message, "code": code}).encode(), content_type="application/json")
+
+
+def snowflake():
+    return str(next(SNOWFLAKES))
+
+
+def timestamp():
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+
+
+def user_payload(user_id, username, bot=False):
+    return {"id": user_id, "username": username, "discriminator": "0", "global_name": None, "avatar": None, "bot": bot}
+
+
+class FakeGuild:
+    def __init__(self, owner_id, name, member_count, role_count, channel_count):
+        self.id = snowflake()
+        self.name = name
+        self.owner_id = owner_id
+        self.roles = {}
+        self.channels = {}
+        self.members = {}
+        self.created_channels = []
+        self.created_roles = []
+
+        self.add_role("@everyone", role_id=self.id, permissions="0")
+        self.admin_role = self.add_role("Admin", permissions=str(ADMINISTRATOR))
+        for i in range(role_count):
+            self.add_role(f"role-{i}")
+
+        ops = self.add_channel("ops", CHANNEL_CATEGORY)
+        self.command_channel = self.add_channel("admin-commands", CHANNEL_TEXT, parent_id=ops["id"])
+        for i in range(channel_count):
+            self.add_channel(f"chan-{i}", CHANNEL_TEXT, parent_id=ops["id"])
+
+        role_ids = [role_id for role_id in self.roles if role_id not in (self.id, self.admin_role["id"])]
+        for i in range(member_count):
+            member_roles = [role_ids[(i + r) % len(role_ids)] for r in range(2)] if role_ids else []
+            self.add_member(snowflake(), f"user-{self.name}-{i}", member_roles)
+
+    def add_role(self, name, role_id=None, permissions="0"):
+        role = {
+            "id": role_id or snowflake(),
+            "name": name,
+            "color": 0,
+            "colors": {"primary_color": 0, "secondary_color": None, "tertiary_color": None},
+            "hoist": False,
+            "icon": None,
+            "unicode_emoji": None,
+            "position": len(self.roles),
+            "permissions": permissions,
+            "managed": False,
+            "mentionable": False,
+            "flags": 0,
+        }
+        self.roles[role["id"]] = role
+        return role
+
+    def add_channel(self, name, channel_type, parent_id=None, overwrites=None):
+        channel = {
+            "id": snowflake(),
+            "type": channel_type,
+            "guild_id": self.id,
+            "name": name,
+            "position": len(self.channels),
+            "permission_overwrites": overwrites or [],
+            "parent_id": parent_id,
+            "nsfw": False,
+            "topic": None,
+            "last_message_id": None,
+            "rate_limit_per_user": 0,
+            "bitrate": 64000,
+            "user_limit": 0,
+        }
+        self.channels[channel["id"]] = channel
+        return channel
+
+    def add_member(self, user_id, username, role_ids):
+        member = {
+            "user": user_payload(user_id, username),
+            "nick": None,
+            "roles": list(role_ids),
+            "joined_at": timestamp(),
+            "deaf": False,
+            "mute": False,
+            "flags": 0,
+        }
+        self.members[user_id] = member
+        return member
+
+    def payload(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "owner_id": self.owner_id,
+            "roles": list(self.roles.values()),
+            "channels": list(self.channels.values()),
+            "members": list(self.members.values()),
+            "member_count": len(self.members),
+            "large": False,
+            "unavailable": False,
+            "emojis": [],
+            "stickers": [],
+            "features": [],
+            "threads": [],
+            "voice_states": [],
+            "presences": [],
+            "stage_instances": [],
+            "guild_scheduled_events": [],
+            "soundboard_sounds": [],
+            "premium_tier": 0,
+            "preferred_locale": "en-US",
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "nsfw_level": 0,
+            "system_channel_flags": 0,
+        }
+
+
+class FakeDiscord:
+    """In-memory Discord. Start with `await server.start()`; `stats` holds request and 429 counts."""
+
+    def __init__(self, host="127.0.0.1", port=0, bucket_limit=10, bucket_window=1.0):
+        self.host = host
+        self.port = port
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.bots = {}
+        self.guilds = {}
+        self.sockets = {}
+        self.attachments = {}
+        self.buckets = {}
+        self.stats = Counter()
+        # Bot replies (message contents, including edits) by the ID of the command message they answer
+        self.replies = defaultdict(list)
+        self.runner = None
+
+        app = web.Application(middlewares=[self.rate_limit_middleware])
+        api = API_PREFIX
+        app.router.add_get(f"{api}/users/@me", self.get_me)
+        app.router.add_get(f"{api}/oauth2/applications/@me", self.get_application)
+        app.router.add_get(f"{api}/gateway/bot", self.get_gateway)
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_get("/attachments/{attachment_id}/{filename}", self.get_attachment)
+        app.router.add_post(f"{api}/channels/{{channel_id}}/messages", self.create_message)
+        app.router.add_patch(f"{api}/channels/{{channel_id}}/messages/{{message_id}}", self.edit_message)
+        app.router.add_delete(f"{api}/channels/{{channel_id}}/messages/{{message_id}}", self.no_content)
+        app.router.add_put(f"{api}/channels/{{channel_id}}/permissions/{{target_id}}", self.edit_permissions)
+        app.router.add_delete(f"{api}/channels/{{channel_id}}/permissions/{{target_id}}", self.delete_permissions)
+        app.router.add_post(f"{api}/guilds/{{guild_id}}/roles", self.create_role)
+        app.router.add_delete(f"{api}/guilds/{{guild_id}}/roles/{{role_id}}", self.delete_role)
+        app.router.add_post(f"{api}/guilds/{{guild_id}}/channels", self.create_channel)
+        app.router.add_get(f"{api}/guilds/{{guild_id}}/members", self.list_members)
+        app.router.add_patch(f"{api}/guilds/{{guild_id}}/members/{{user_id}}", self.edit_member)
+        app.router.add_put(f"{api}/guilds/{{guild_id}}/members/{{user_id}}/roles/{{role_id}}", self.add_member_role)
+        app.router.add_delete(f"{api}/guilds/{{guild_id}}/members/{{user_id}}/roles/{{role_id}}", self.remove_member_role)
+        self.app = app
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    # Setup
+
+    def add_bot(self, token, name):
+        self.bots[token] = {"user": user_payload(snowflake(), name, bot=True), "guilds": []}
+        return self.bots[token]
+
+    def add_guild(self, token, admin_count=3, member_count=200, role_count=20, channel_count=30):
+        """Creates a guild for a bot, owned by the first of its admins. Returns (guild, admin user IDs)."""
+        admins = [snowflake() for _ in range(admin_count)]
+        guild = FakeGuild(admins[0], f"g{len(self.guilds)}", member_count, role_count, channel_count)
+        for i, admin_id in enumerate(admins):
+            guild.add_member(admin_id, f"admin-{guild.name}-{i}", [guild.admin_role["id"]])
+        guild.add_member(self.bots[token]["user"]["id"], self.bots[token]["user"]["username"], [guild.admin_role["id"]])
+        self.guilds[guild.id] = guild
+        self.bots[token]["guilds"].append(guild.id)
+        guild.token = token
+        return guild, admins
+
+    def add_attachment(self, filename, content):
+        attachment_id = snowflake()
+        self.attachments[attachment_id] = content.encode("utf-8")
+        return {
+            "id": attachment_id,
+            "filename": filename,
+            "size": len(self.attachments[attachment_id]),
+            "url": f"{self.url}/attachments/{attachment_id}/{filename}",
+            "proxy_url": f"{self.url}/attachments/{attachment_id}/{filename}",
+        }
+
+    # Gateway
+
+    async def dispatch(self, token, event, data):
+        ws = self.sockets.get(token)
+        if ws is None or ws.closed:
+            return
+        ws.sequence += 1
+        self.stats["gateway_events"] += 1
+        await ws.send_str(json.dumps({"op": 0, "t": event, "s": ws.sequence, "d": data}))
+
+    def command_message(self, guild, author_id, content, attachments=()):
+        """Builds a message from an admin in the guild's command channel; send it with send_message()."""
+        member = guild.members[author_id]
+        message = self.message_payload(guild.command_channel["id"], member["user"], content, list(attachments))
+        message["guild_id"] = guild.id
+        message["member"] = {key: value for key, value in member.items() if key != "user"}
+        return message
+
+    async def send_message(self, guild, message):
+        await self.dispatch(guild.token, "MESSAGE_CREATE", message)
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        ws.sequence = 0
+        await ws.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}}))
+        token = None
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(msg.data)
+            op = payload["op"]
+            if op == 1:
+                await ws.send_str(json.dumps({"op": 11}))
+            elif op == 2:
+                token = payload["d"]["token"]
+                self.sockets[token] = ws
+                await self.identify(token)
+            elif op == 8:
+                guild = self.guilds[str(payload["d"]["guild_id"])]
+                await self.dispatch(token, "GUILD_MEMBERS_CHUNK", {
+                    "guild_id": guild.id,
+                    "members": list(guild.members.values()),
+                    "chunk_index": 0,
+                    "chunk_count": 1,
+                    "nonce": payload["d"].get("nonce"),
+                })
+        if token and self.sockets.get(token) is ws:
+            del self.sockets[token]
+        return ws
+
+    async def identify(self, token):
+        bot = self.bots[token]
+        await self.dispatch(token, "READY", {
+            "v": 10,
+            "user": bot["user"],
+            "guilds": [{"id": guild_id, "unavailable": True} for guild_id in bot["guilds"]],
+            "session_id": snowflake(),
+            "resume_gateway_url": f"ws://{self.host}:{self.port}/gateway",
+            "application": {"id": bot["user"]["id"], "flags": 0},
+            "shard": [0, 1],
+        })
+        for guild_id in bot["guilds"]:
+            await self.dispatch(token, "GUILD_CREATE", self.guilds[guild_id].payload())
+
+    # Rate limits
+
+    @web.middleware
+    async def rate_limit_middleware(self, request, handler):
+        if not request.path.startswith(API_PREFIX):
+            return await handler(request)
+        self.stats["requests"] += 1
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        major = request.match_info.get("channel_id") or request.match_info.get("guild_id") or ""
+        bucket_hash = f"{request.method}:{route}"
+        now = time.monotonic()
+        window_start, used = self.buckets.get((bucket_hash, major), (now, 0))
+        if now - window_start >= self.bucket_window:
+            window_start, used = now, 0
+        reset_after = self.bucket_window - (now - window_start)
+        headers = {
+            "X-RateLimit-Limit": str(self.bucket_limit),
+            "X-RateLimit-Bucket": str(abs(hash(bucket_hash))),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Reset": f"{time.time() + reset_after:.3f}",
+        }
+        if used >= self.bucket_limit:
+            self.stats["429"] += 1
+            headers["X-RateLimit-Remaining"] = "0"
+            headers["Retry-After"] = f"{reset_after:.3f}"
+            headers["Via"] = "1.1 fake-discord"
+            return json_response({"message": "You are being rate limited.", "retry_after": reset_after, "global": False}, status=429, headers=headers)
+        self.buckets[(bucket_hash, major)] = (window_start, used + 1)
+        headers["X-RateLimit-Remaining"] = str(self.bucket_limit - used - 1)
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    # REST handlers
+
+    def token_for(self, request):
+        return request.headers.get("Authorization", "").removeprefix("Bot ")
+
+    def channel_and_guild(self, channel_id):
+        for guild in self.guilds.values():
+            if channel_id in guild.channels:
+                return guild.channels[channel_id], guild
+        raise not_found("Unknown Channel", 10003)
+
+    def guild(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            raise not_found("Unknown Guild", 10004)
+        return guild
+
+    def record_reply(self, request, content):
+        reason = unquote(request.headers.get(COMMAND_HEADER, ""))
+        if reason.startswith(COMMAND_TAG):
+            self.replies[reason[len(COMMAND_TAG):]].append(content)
+
+    def message_payload(self, channel_id, author, content, attachments=()):
+        return {
+            "id": snowflake(),
+            "channel_id": channel_id,
+            "author": author,
+            "content": content,
+            "timestamp": timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": list(attachments),
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+
+    async def read_payload(self, request):
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            return json.loads(form.get("payload_json", "{}"))
+        if request.can_read_body:
+            return await request.json()
+        return {}
+
+    async def no_content(self, request):
+        return web.Response(status=204)
+
+    async def get_me(self, request):
+        return json_response(self.bots[self.token_for(request)]["user"])
+
+    async def get_application(self, request):
+        user = self.bots[self.token_for(request)]["user"]
+        return json_response({
+            "id": user["id"],
+            "name": user["username"],
+            "description": "",
+            "icon": None,
+            "bot_public": False,
+            "bot_require_code_grant": False,
+            "owner": user_payload(snowflake(), "soak-owner"),
+            "verify_key": "0" * 64,
+            "flags": 0,
+        })
+
+    async def get_gateway(self, request):
+        return json_response({"url": f"ws://{self.host}:{self.port}/gateway", "shards": 1, "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}})
+
+    async def get_attachment(self, request):
+        return web.Response(body=self.attachments[request.match_info["attachment_id"]])
+
+    async def create_message(self, request):
+        payload = await self.read_payload(request)
+        self.stats["messages"] += 1
+        author = self.bots[self.token_for(request)]["user"]
+        self.record_reply(request, payload.get("content") or "")
+        return json_response(self.message_payload(request.match_info["channel_id"], author, payload.get("content") or ""))
+
+    async def edit_message(self, request):
+        payload = await self.read_payload(request)
+        author = self.bots[self.token_for(request)]["user"]
+        message = self.message_payload(request.match_info["channel_id"], author, payload.get("content") or "")
+        message["id"] = request.match_info["message_id"]
+        self.record_reply(request, payload.get("content") or "")
+        return json_response(message)
+
+    async def edit_permissions(self, request):
+        channel, guild = self.channel_and_guild(request.match_info["channel_id"])
+        payload = await request.json()
+        target_id = request.match_info["target_id"]
+        overwrites = [ow for ow in channel["permission_overwrites"] if ow["id"] != target_id]
+        overwrites.append({"id": target_id, "type": payload.get("type", 0), "allow": str(payload.get("allow", "0")), "deny": str(payload.get("deny", "0"))})
+        channel["permission_overwrites"] = overwrites
+        await self.dispatch(guild.token, "CHANNEL_UPDATE", channel)
+        return web.Response(status=204)
+
+    async def delete_permissions(self, request):
+        channel, guild = self.channel_and_guild(request.match_info["channel_id"])
+        target_id = request.match_info["target_id"]
+        channel["permission_overwrites"] = [ow for ow in channel["permission_overwrites"] if ow["id"] != target_id]
+        await self.dispatch(guild.token, "CHANNEL_UPDATE", channel)
+        return web.Response(status=204)
+
+    async def create_role(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        payload = await request.json()
+        role = guild.add_role(payload.get("name", "new role"), permissions=str(payload.get("permissions", "0")))
+        guild.created_roles.append(role["id"])
+        await self.dispatch(guild.token, "GUILD_ROLE_CREATE", {"guild_id": guild.id, "role": role})
+        if len(guild.created_roles) > MAX_CREATED_ROLES:
+            await self.remove_role(guild, guild.created_roles[0])
+        return json_response(role)
+
+    async def delete_role(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        role_id = request.match_info["role_id"]
+        if role_id not in guild.roles:
+            return json_response({"message": "Unknown Role", "code": 10011}, status=404)
+        await self.remove_role(guild, role_id)
+        return web.Response(status=204)
+
+    async def remove_role(self, guild, role_id):
+        guild.roles.pop(role_id, None)
+        if role_id in guild.created_roles:
+            guild.created_roles.remove(role_id)
+        for member in guild.members.values():
+            if role_id in member["roles"]:
+                member["roles"].remove(role_id)
+        for channel in guild.channels.values():
+            channel["permission_overwrites"] = [ow for ow in channel["permission_overwrites"] if ow["id"] != role_id]
+        await self.dispatch(guild.token, "GUILD_ROLE_DELETE", {"guild_id": guild.id, "role_id": role_id})
+
+    async def create_channel(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        payload = await request.json()
+        overwrites = [{"id": str(ow["id"]), "type": ow.get("type", 0), "allow": str(ow.get("allow", "0")), "deny": str(ow.get("deny", "0"))} for ow in payload.get("permission_overwrites", [])]
+        parent_id = str(payload["parent_id"]) if payload.get("parent_id") else None
+        channel = guild.add_channel(payload["name"], payload.get("type", CHANNEL_TEXT), parent_id=parent_id, overwrites=overwrites)
+        guild.created_channels.append(channel["id"])
+        await self.dispatch(guild.token, "CHANNEL_CREATE", channel)
+        if len(guild.created_channels) > MAX_CREATED_CHANNELS:
+            old = guild.channels.pop(guild.created_channels.pop(0), None)
+            if old:
+                await self.dispatch(guild.token, "CHANNEL_DELETE", old)
+        return json_response(channel)
+
+    async def list_members(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        limit = int(request.query.get("limit", 1))
+        after = int(request.query.get("after", 0))
+        members = sorted((int(user_id), member) for user_id, member in guild.members.items())
+        return json_response([member for user_id, member in members if user_id > after][:limit])
+
+    async def update_member(self, guild, user_id, role_ids):
+        member = guild.members[user_id]
+        member["roles"] = [role_id for role_id in dict.fromkeys(role_ids) if role_id in guild.roles]
+        await self.dispatch(guild.token, "GUILD_MEMBER_UPDATE", {"guild_id": guild.id, **member})
+        return member
+
+    async def edit_member(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        payload = await request.json()
+        member = guild.members[request.match_info["user_id"]]
+        role_ids = [str(role_id) for role_id in payload.get("roles", member["roles"])]
+        return json_response(await self.update_member(guild, request.match_info["user_id"], role_ids))
+
+    async def add_member_role(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        member = guild.members[request.match_info["user_id"]]
+        await self.update_member(guild, request.match_info["user_id"], member["roles"] + [request.match_info["role_id"]])
+        return web.Response(status=204)
+
+    async def remove_member_role(self, request):
+        guild = self.guild(request.match_info["guild_id"])
+        member = guild.members[request.match_info["user_id"]]
+        role_id = request.match_info["role_id"]
+        await self.update_member(guild, request.match_info["user_id"], [r for r in member["roles"] if r != role_id])
+        return web.Response(status=204)
+
+
+async def main():
+    """Runs the stand-in on its own, e.g. to point a manually started bot at it."""
+    server = FakeDiscord(port=8787)
+    await server.start()
+    print(f"Fake Discord listening on {server.url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,420 @@
+"""Multi-guild soak test for dosi.py against the local fake Discord.
+
+The bot runs in this process with half of the guilds on the stable command set and half on
+the beta set. Every guild has a few admins who issue a random mix of the set's commands and
+the core commands (!profile_loop, !command_set, !memory) concurrently, with an exponential
+think time between commands; optionally an admin also runs !reload at a fixed interval.
+Every report interval the harness prints (and appends to a JSONL file) p50/p99 command
+latency and reply count per command set and command, errors (exceptions and replies that
+report a failure or unknown users), per-guild fairness, 429 responses, RSS, asyncio task
+count and thread count.
+
+Usage: python soak/run_soak.py --duration 7200 --guilds 20 --admins 3
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from discord.gateway import DiscordWebSocket
+from discord.http import Route
+import yarl
+
+from fake_discord import COMMAND_TAG, FakeDiscord
+
+BOT_TOKEN = "soak-bot-token"
+
+# Commands that have not completed after this long are counted as lost
+COMMAND_TIMEOUT = 300
+
+# ID of the command message being handled, so the bot's requests can be tagged with it
+command_message = contextvars.ContextVar("command_message", default=None)
+
+
+def rss_bytes():
+    """Resident set size of this process, from /proc (Linux only)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def load_bot(token, extra_env=None):
+    """Imports dosi.py with the soak token; it only calls bot.run() when run directly."""
+    os.environ["BOT_TOKEN"] = token
+    for key, value in (extra_env or {}).items():
+        os.environ[key] = value
+    import dosi
+    return dosi.bot
+
+
+def stable_commands(guild, state):
+    """One random dosi.py command line. Returns (content, attachments)."""
+    role = random.choice(guild.role_names)
+    other = random.choice(guild.role_names)
+    channels = random.sample(guild.channel_names, 3)
+    users = random.sample(guild.user_names, 5)
+    temp = f"soak-{next(state.counter)}"
+    choices = [
+        (8, lambda: (f"!assignRole {role} {' '.join(users)}", [])),
+        (8, lambda: (f"!remove_role {role} {' '.join(users)}", [])),
+        (3, lambda: ("!assignRole", [state.roster(guild, role)])),
+        (6, lambda: (f"!add_roles_to_channels -r {role} -ch {' '.join(channels)}", [])),
+        (2, lambda: (f"!add_roles_to_channels -r {other}", [])),
+        (6, lambda: (f"!delete_roles_from_channels -r {role} -ch {' '.join(channels)}", [])),
+        (2, lambda: (f"!delete_roles_from_channels -r {other} --all", [])),
+        (4, lambda: (f"!audit_overwrites {role}", [])),
+        (4, lambda: (f"!remove_messaging_permissions -r {role} -ch {' '.join(channels)}", [])),
+        (3, lambda: (f"!export_role_members {role}", [])),
+        (4, lambda: (f"!create_roles {temp}", [])),
+        (3, lambda: (f"!delete_roles {state.created_role(guild)}", [])),
+        (1, lambda: (f"!delete_roles {role} --dry-run", [])),
+        (2, lambda: (f"!create_categories_with_channels -m {temp} -r {role} -ch {temp}-a {temp}-b", [])),
+        (2, lambda: (f"!create_categories_with_channels -m {temp} -r {role} -ch {temp}-c --dry-run", [])),
+        (2, lambda: ("!confirm", [])),
+    ]
+    return pick(choices + core_commands("stable"))
+
+
+def beta_commands(guild, state):
+    """One random dosi_beta.py command line. Returns (content, attachments)."""
+    role = random.choice(guild.role_names)
+    channels = random.sample(guild.channel_names, 3)
+    users = random.sample(guild.user_names, 5)
+    temp = f"soak-{next(state.counter)}"
+    choices = [
+        (8, lambda: (f"!assign_role {role} {' '.join(users)}", [])),
+        (8, lambda: (f"!remove_role {role} {' '.join(users)}", [])),
+        (6, lambda: (f"!add_roles_to_channels -r {role} -ch {' '.join(channels)}", [])),
+        (6, lambda: (f"!delete_roles_from_channels -r {role} -ch {' '.join(channels)}", [])),
+        (4, lambda: (f"!remove_messaging_permissions -r {role} -ch {' '.join(channels)}", [])),
+        (4, lambda: (f"!create_roles {temp}", [])),
+        (3, lambda: (f"!delete_roles {state.created_role(guild)}", [])),
+        (2, lambda: (f"!create_category_with_channels {temp} -r {role} -ch {temp}-a -a {temp}-v", [])),
+    ]
+    return pick(choices + core_commands("beta"))
+
+
+def core_commands(set_name):
+    """Commands every server has, at low weights. They touch process-wide state: the loop
+    sampling thread, the command set file and tracemalloc."""
+    return [
+        (1, lambda: ("!profile_loop 2", [])),
+        (1, lambda: ("!command_set", [])),
+        # Selects the set the guild already uses, so the file is rewritten but the split stays
+        (1, lambda: (f"!command_set {set_name}", [])),
+        (1, lambda: ("!memory", [])),
+        (1, lambda: (random.choice(("!memory snapshot", "!memory diff", "!memory stop")), [])),
+    ]
+
+
+def is_error_reply(content):
+    """Commands catch their own exceptions and reply instead, so failures show up only in the replies."""
+    lowered = content.lower()
+    return content.startswith("Error") or "not found: user" in lowered or "users not found" in lowered
+
+
+def pick(choices):
+    weights = [weight for weight, _ in choices]
+    return random.choices([make for _, make in choices], weights)[0]()
+
+
+class SoakState:
+    def __init__(self, server):
+        self.server = server
+        self.counter = iter(range(1, 10**12))
+        self.pending = {}
+        self.latencies = defaultdict(list)
+        self.guild_latencies = defaultdict(list)
+        self.all_latencies = defaultdict(lambda: array("d"))
+        self.counts = Counter()
+        self.replies = Counter()
+        self.errors = Counter()
+        self.last_snapshot = time.monotonic()
+
+    def roster(self, guild, role):
+        lines = "\n".join(f"{name},{role}" for name in random.sample(guild.user_names, 20))
+        return self.server.add_attachment("roster.csv", "username,role\n" + lines)
+
+    def created_role(self, guild):
+        """Name of a role created earlier by the soak (falls back to a name that does not exist)."""
+        names = [guild.roles[role_id]["name"] for role_id in guild.created_roles if role_id in guild.roles]
+        return random.choice(names) if names else f"soak-missing-{next(self.counter)}"
+
+    def complete(self, ctx, error=None):
+        started = self.pending.pop(ctx.message.id, None)
+        if started is None:
+            return
+        sent, guild_id, set_name = started
+        latency = time.perf_counter() - sent
+        command = ctx.command.qualified_name if ctx.command else "unknown"
+        key = f"{set_name}:{command}"
+        self.latencies[key].append(latency)
+        self.all_latencies[key].append(latency)
+        self.guild_latencies[guild_id].append(latency)
+        self.counts[key] += 1
+        if error is not None:
+            self.errors[f"{key}:{type(error).__name__}"] += 1
+        replies = self.server.replies.pop(str(ctx.message.id), [])
+        self.replies[key] += len(replies)
+        for content in replies:
+            if is_error_reply(content):
+                self.errors[f"{key}:error reply"] += 1
+
+    def expire(self):
+        now = time.perf_counter()
+        lost = [key for key, (sent, _, _) in self.pending.items() if now - sent > COMMAND_TIMEOUT]
+        for key in lost:
+            del self.pending[key]
+            self.server.replies.pop(str(key), None)
+        return len(lost)
+
+
+def track_latency(bot, state):
+    async def on_command_completion(ctx):
+        state.complete(ctx)
+
+    async def on_command_error(ctx, error):
+        state.complete(ctx, error)
+
+    bot.add_listener(on_command_completion)
+    bot.add_listener(on_command_error)
+
+
+def tag_replies(bot):
+    """Tags every request the bot makes while handling a command with that command's message ID.
+    The library only lets callers set the audit log reason header, so the tag travels there."""
+    invoke = bot.invoke
+    request = bot.http.request
+
+    async def tagged_invoke(ctx):
+        token = command_message.set(ctx.message.id)
+        try:
+            await invoke(ctx)
+        finally:
+            command_message.reset(token)
+
+    async def tagged_request(route, **kwargs):
+        message_id = command_message.get()
+        if message_id is not None and not kwargs.get("reason"):
+            kwargs["reason"] = f"{COMMAND_TAG}{message_id}"
+        return await request(route, **kwargs)
+
+    bot.invoke = tagged_invoke
+    bot.http.request = tagged_request
+
+
+async def send_command(server, state, guild, admin_id, set_name, content, attachments=()):
+    message = server.command_message(guild, admin_id, content, attachments)
+    state.pending[int(message["id"])] = (time.perf_counter(), guild.id, set_name)
+    await server.send_message(guild, message)
+
+
+async def admin_loop(server, state, guild, admin_id, set_name, make_command, think, deadline):
+    """One admin: waits a random think time, then sends the next command."""
+    while time.monotonic() < deadline:
+        await asyncio.sleep(random.expovariate(1 / think))
+        content, attachments = make_command(guild, state)
+        await send_command(server, state, guild, admin_id, set_name, content, attachments)
+
+
+async def reload_loop(server, state, guild, admin_id, interval, deadline):
+    """Reloads both command sets at a fixed interval while the other admins keep sending commands."""
+    while time.monotonic() + interval < deadline:
+        await asyncio.sleep(interval)
+        await send_command(server, state, guild, admin_id, "core", "!reload")
+
+
+def snapshot(state, server, started, baseline_rss, lost):
+    rss = rss_bytes()
+    now = time.monotonic()
+    interval = max(now - state.last_snapshot, 0.001)
+    state.last_snapshot = now
+    per_command = {}
+    for key, values in sorted(state.latencies.items()):
+        per_command[key] = {
+            "count": len(values),
+            "replies": state.replies[key],
+            "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+        }
+    guild_p50s = [percentile(values, 0.5) for values in state.guild_latencies.values() if values]
+    report = {
+        "elapsed_s": round(now - started, 1),
+        "commands_per_s": round(sum(len(values) for values in state.latencies.values()) / interval, 2),
+        "commands": per_command,
+        "guild_p50_ms": {
+            "min": round(min(guild_p50s) * 1000, 1) if guild_p50s else None,
+            "max": round(max(guild_p50s) * 1000, 1) if guild_p50s else None,
+        },
+        "in_flight": len(state.pending),
+        "lost": lost,
+        "errors": dict(state.errors),
+        "requests": server.stats["requests"],
+        "rate_limited_429": server.stats["429"],
+        "gateway_events": server.stats["gateway_events"],
+        "rss_mb": round(rss / 1024 / 1024, 1) if rss else None,
+        "rss_growth_mb": round((rss - baseline_rss) / 1024 / 1024, 1) if rss and baseline_rss else None,
+        "asyncio_tasks": len(asyncio.all_tasks()),
+        "threads": threading.active_count(),
+    }
+    state.latencies.clear()
+    state.guild_latencies.clear()
+    state.replies.clear()
+    state.errors.clear()
+    return report
+
+
+def print_report(report, out):
+    print(f"--- {report['elapsed_s']:.0f}s: {report['commands_per_s']} cmd/s, {report['in_flight']} in flight, {report['lost']} lost, "
+          f"{report['rate_limited_429']} 429s total, RSS {report['rss_mb']} MB (+{report['rss_growth_mb']}), "
+          f"{report['asyncio_tasks']} tasks, {report['threads']} threads", file=out)
+    for key, row in report["commands"].items():
+        print(f"    {key:<48} n={row['count']:<6} replies={row['replies']:<6} p50={row['p50_ms']:>8} ms  p99={row['p99_ms']:>8} ms", file=out)
+    print(f"    guild p50 spread: {report['guild_p50_ms']['min']} - {report['guild_p50_ms']['max']} ms", file=out)
+    for key, count in report["errors"].items():
+        print(f"    error {key}: {count}", file=out)
+
+
+async def main(args):
+    random.seed(args.seed)
+    out = sys.stdout
+    if args.quiet:
+        # The bot prints a line per role or channel change; keep only the harness output
+        sys.stdout = open(os.devnull, "w")
+    server = FakeDiscord(bucket_limit=args.bucket_limit, bucket_window=args.bucket_window)
+    await server.start()
+    print(f"Fake Discord listening on {server.url}", file=out)
+
+    Route.BASE = f"{server.url}/api/v10"
+    DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(f"ws://{server.host}:{server.port}/gateway")
+
+    os.environ.setdefault("TRACE_FILE", os.path.join(args.output_dir, "soak_trace.json"))
+    os.environ.setdefault("COMMAND_SET_FILE", os.path.join(args.output_dir, "soak_command_sets.json"))
+    extra_env = {"COMPACT_MEMBER_CACHE": "1"} if args.compact_member_cache else {}
+    if args.cache_budgets:
+        extra_env["CACHE_BUDGETS"] = args.cache_budgets
+    bot = load_bot(BOT_TOKEN, extra_env)
+    import command_sets
+
+    state = SoakState(server)
+    server.add_bot(BOT_TOKEN, "dosi")
+    admins = []
+    for index in range(args.guilds):
+        set_name, make_command = ("stable", stable_commands) if index % 2 == 0 else ("beta", beta_commands)
+        guild, admin_ids = server.add_guild(BOT_TOKEN, args.admins, args.members, args.roles, args.channels)
+        command_sets.set_guild_command_set(int(guild.id), set_name)
+        guild.role_names = [role["name"] for role in guild.roles.values() if role["name"].startswith("role-")]
+        guild.channel_names = [channel["name"] for channel in guild.channels.values() if channel["name"].startswith("chan-")]
+        guild.user_names = [member["user"]["username"] for member in guild.members.values() if member["user"]["username"].startswith("user-")]
+        admins.extend((guild, admin_id, set_name, make_command) for admin_id in admin_ids)
+
+    track_latency(bot, state)
+    tag_replies(bot)
+    ready_event = asyncio.Event()
+
+    async def set_ready():
+        ready_event.set()
+
+    bot.add_listener(set_ready, "on_ready")
+    bot_task = asyncio.create_task(bot.start(BOT_TOKEN))
+    await asyncio.wait_for(ready_event.wait(), timeout=120)
+    await asyncio.sleep(args.warmup)
+    print(f"Bot ready in {args.guilds} guild(s) with {len(admins)} admin(s)", file=out)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_path = os.path.join(args.output_dir, "soak_report.jsonl")
+    started = time.monotonic()
+    deadline = started + args.duration
+    baseline_rss = rss_bytes()
+    state.last_snapshot = started
+    admin_tasks = [
+        asyncio.create_task(admin_loop(server, state, guild, admin_id, set_name, make_command, args.think, deadline))
+        for guild, admin_id, set_name, make_command in admins
+    ]
+    if args.reload_interval:
+        guild, admin_id, _, _ = admins[0]
+        admin_tasks.append(asyncio.create_task(reload_loop(server, state, guild, admin_id, args.reload_interval, deadline)))
+
+    with open(report_path, "a", encoding="utf-8") as report_file:
+        lost = 0
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(args.report_interval, max(0.0, deadline - time.monotonic())))
+            lost += state.expire()
+            report = snapshot(state, server, started, baseline_rss, lost)
+            print_report(report, out)
+            report_file.write(json.dumps(report) + "\n")
+            report_file.flush()
+
+        await asyncio.gather(*admin_tasks, return_exceptions=True)
+        # Let commands still in flight finish before the final report
+        drain_deadline = time.monotonic() + args.drain
+        while state.pending and time.monotonic() < drain_deadline:
+            await asyncio.sleep(0.5)
+        report = snapshot(state, server, started, baseline_rss, lost + len(state.pending))
+        report["final"] = True
+        report["overall"] = {
+            key: {"count": len(values), "p50_ms": round(percentile(values, 0.5) * 1000, 1), "p99_ms": round(percentile(values, 0.99) * 1000, 1)}
+            for key, values in sorted(state.all_latencies.items())
+        }
+        print_report(report, out)
+        print("Overall:", file=out)
+        for key, row in report["overall"].items():
+            print(f"    {key:<48} n={row['count']:<6} p50={row['p50_ms']:>8} ms  p99={row['p99_ms']:>8} ms", file=out)
+        report_file.write(json.dumps(report) + "\n")
+
+    await bot.close()
+    await asyncio.gather(bot_task, return_exceptions=True)
+    await server.stop()
+    print(f"Report written to {report_path}", file=out)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=3600, help="seconds of load (default 3600)")
+    parser.add_argument("--guilds", type=int, default=10, help="guilds, split between the stable and beta command sets")
+    parser.add_argument("--admins", type=int, default=3, help="admins issuing commands per guild")
+    parser.add_argument("--members", type=int, default=500, help="members per guild")
+    parser.add_argument("--roles", type=int, default=20, help="roles per guild")
+    parser.add_argument("--channels", type=int, default=30, help="channels per guild")
+    parser.add_argument("--think", type=float, default=5.0, help="mean seconds between an admin's commands")
+    parser.add_argument("--bucket-limit", type=int, default=10, help="requests per rate limit bucket window")
+    parser.add_argument("--bucket-window", type=float, default=1.0, help="rate limit bucket window in seconds")
+    parser.add_argument("--report-interval", type=float, default=60, help="seconds between reports")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds to wait after the bot is ready")
+    parser.add_argument("--reload-interval", type=float, default=0, help="seconds between !reload commands (default: never)")
+    parser.add_argument("--drain", type=float, default=60, help="seconds to wait for in-flight commands at the end")
+    parser.add_argument("--compact-member-cache", action="store_true", help="run the bot with COMPACT_MEMBER_CACHE=1")
+    parser.add_argument("--cache-budgets", default="", help='run the bot with CACHE_BUDGETS, e.g. "members=2MB,messages=256KB"')
+    parser.add_argument("--quiet", action="store_true", help="hide the bot's own output")
+    parser.add_argument("--output-dir", default="soak_results", help="directory for the report and trace files")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+    asyncio.run(main(args))
@@ -0,0 +1,205 @@
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import aiohttp
+
+# Traces are written in the Chrome Trace Event format (JSON array form), which
+# chrome://tracing, Perfetto and speedscope can open directly.
+TRACE_FILE = os.getenv('TRACE_FILE', 'dosi_trace.json')
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = 5
+
+# Offset that turns perf_counter() readings into wall clock time
+TRACE_EPOCH = time.time() - time.perf_counter()
+
+current_span = contextvars.ContextVar("current_span", default=None)
+trace_ids = itertools.count(1)
+trace_logger = logging.getLogger("dosi.trace")
+trace_listener = None
+
+
+class TraceFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating trace file; every new file starts with "[" and events end with ",".
+    The closing "]" is optional in the JSON array trace format, so files stay valid while being written."""
+
+    terminator = ",\n"
+
+    def _open(self):
+        stream = super()._open()
+        if stream.tell() == 0:
+            stream.write("[\n")
+        return stream
+
+
+class Span:
+    """A timed section of a command trace, emitted as a complete ("X") trace event when it ends."""
+
+    def __init__(self, name, category, trace_id, args=None):
+        self.name = name
+        self.category = category
+        self.trace_id = trace_id
+        self.args = args or {}
+        self.start = time.perf_counter()
+        self.children_time = 0.0
+        self.ended = False
+
+    def end(self, **args):
+        if self.ended:
+            return 0.0
+        self.ended = True
+        duration = time.perf_counter() - self.start
+        self.args.update(args)
+        event = {
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": round((TRACE_EPOCH + self.start) * 1_000_000),
+            "dur": round(duration * 1_000_000),
+            "pid": os.getpid(),
+            "tid": self.trace_id,
+            "args": self.args,
+        }
+        trace_logger.info(json.dumps(event, default=str))
+        return duration
+
+
+@contextlib.contextmanager
+def trace_span(name, category="command", **args):
+    """Records a child span of the current command trace. Does nothing outside a traced command."""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(name, category, parent.trace_id, args)
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.args["error"] = repr(e)
+        raise
+    finally:
+        current_span.reset(token)
+        span.end()
+
+
+@contextlib.contextmanager
+def trace_command(ctx):
+    """Traces one command invocation; library argument parsing is its first child span."""
+    if ctx.command is None:
+        yield None
+        return
+    trace_id = next(trace_ids)
+    span = Span(ctx.command.qualified_name, "invocation", trace_id, {
+        "guild": str(ctx.guild),
+        "guild_id": ctx.guild.id if ctx.guild else None,
+        "author": str(ctx.author),
+        "message": ctx.message.content[:200],
+    })
+    token = current_span.set(span)
+    ctx.trace_parse_span = Span("parse_arguments", "command", trace_id, {"stage": "converters"})
+    try:
+        yield span
+    except BaseException as e:
+        span.args["error"] = repr(e)
+        raise
+    finally:
+        ctx.trace_parse_span.end()
+        current_span.reset(token)
+        span.end()
+
+
+def mark_arguments_parsed(ctx):
+    """Ends the library argument parsing span; call from the bot's before_invoke hook."""
+    parse_span = getattr(ctx, "trace_parse_span", None)
+    if parse_span:
+        parse_span.end()
+
+
+def wrap_http_request(request):
+    """Wraps HTTPClient.request so every REST call is a span, including its rate limit waits and retries."""
+
+    async def traced_request(route, **kwargs):
+        parent = current_span.get()
+        if parent is None:
+            return await request(route, **kwargs)
+        # Responses to the invoking admin (sends and progress edits) get their own span name
+        is_response = route.path.startswith("/channels/{channel_id}/messages")
+        name = "send_response" if is_response else f"{route.method} {route.path}"
+        span = Span(name, "rest", parent.trace_id, {"route": f"{route.method} {route.url}", "attempts": 0, "rate_limited": 0, "http_time_ms": 0.0})
+        token = current_span.set(span)
+        try:
+            return await request(route, **kwargs)
+        except BaseException as e:
+            span.args["error"] = repr(e)
+            raise
+        finally:
+            current_span.reset(token)
+            # Anything not spent in an HTTP attempt was spent waiting on rate limit buckets, 429s or retry backoff
+            total = time.perf_counter() - span.start
+            span.end(wait_ms=round((total - span.children_time) * 1000, 3))
+
+    return traced_request
+
+
+def create_http_trace():
+    """Returns an aiohttp TraceConfig that records each HTTP attempt under the current REST span."""
+
+    async def on_request_start(session, context, params):
+        parent = current_span.get()
+        if parent is not None and parent.category == "rest":
+            context.span = Span("http_attempt", "http", parent.trace_id, {"method": params.method})
+            context.parent = parent
+
+    async def on_request_end(session, context, params):
+        span = getattr(context, "span", None)
+        if span is None:
+            return
+        status = params.response.status
+        context.parent.args["attempts"] += 1
+        if status == 429:
+            context.parent.args["rate_limited"] += 1
+            span.args["retry_after"] = params.response.headers.get("Retry-After")
+        duration = span.end(status=status)
+        context.parent.children_time += duration
+        context.parent.args["http_time_ms"] = round(context.parent.children_time * 1000, 3)
+
+    async def on_request_exception(session, context, params):
+        span = getattr(context, "span", None)
+        if span is None:
+            return
+        context.parent.args["attempts"] += 1
+        context.parent.children_time += span.end(error=repr(params.exception))
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def install_tracing(bot):
+    """Traces REST calls made by the bot and starts the background trace file writer."""
+    global trace_listener
+    bot.http.http_trace = create_http_trace()
+    bot.http.request = wrap_http_request(bot.http.request)
+
+    if trace_listener is None:
+        # Trace events are queued and written by a listener thread, so file I/O never blocks the event loop
+        directory = os.path.dirname(TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        trace_queue = queue.SimpleQueue()
+        trace_logger.setLevel(logging.INFO)
+        trace_logger.propagate = False
+        trace_logger.addHandler(logging.handlers.QueueHandler(trace_queue))
+        file_handler = TraceFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8")
+        trace_listener = logging.handlers.QueueListener(trace_queue, file_handler)
+        trace_listener.start()
+        atexit.register(trace_listener.stop)